@@ -2,6 +2,7 @@ import streamlit as st
 from streamlit.delta_generator import DeltaGenerator as Delta
 import time
 import os
+from contextlib import nullcontext
 
 from .styles import Style
 from .write import st_write
@@ -13,25 +14,49 @@ from .list import st_list
 from .overlay import st_overlay
 from .toc import reset_toc_registry, toc_entries, TOCConfig
 from .enums import Tags
-from .utils import inject_link_preview_scaffold
+from .utils import inject_link_preview_scaffold, key_scope, reset_key_scope, current_key_scope, fork_key_scope, resumed_key_scope
+from .config import BookConfig, set_book_config, get_book_config
+from .cache import active_recorder, record_dependency, render_cached, replay, source_hash
+from . import styles
+from .toc import toc_state, resumed_toc, register_toc_entry, current_toc_config
+from .lazy import loaded_block_count, recording_block_toc, register_block_toc, st_load_more
+from .buffer import html_buffer
+from .stylesheet import book_stylesheet, block_stylesheet, write_new_rules
+from .backend import backend, active_document
+from .theme import add_theme_options
 
 import importlib.resources as resources
 
 streamtex_zoom = "streamtex_zoom"
+toc_title = "Table of Contents"
 
-def st_book(module_list, toc_config: TOCConfig = None, *args, **kwargs):
+def st_book(module_list, toc_config: TOCConfig = None, *args, book_config: BookConfig = None, **kwargs):
     """Generates a web page e-book from a list of block modules."""
+    document = active_document()
+    if document is not None and document.capture_only:
+        document.book = (module_list, toc_config, args, book_config, kwargs)
+        return
+
     start_time = time.time()
     print("Starting st_book function...")
 
+    # Apply the rendering options for this run
+    set_book_config(book_config)
+    reset_key_scope()
+
     # Load default CSS styles
     load_css("default.css")
     
     # Ensure the hover card is ready before any content is rendered.
     inject_link_preview_scaffold()
     
-    # Add zoom options to sidebar
-    add_zoom_options()
+    # Add zoom options to sidebar (a rendered document has no widgets: it is fit to the window)
+    exporting = active_document() is not None
+    if exporting:
+        inject_zoom_logic("Fit")
+    else:
+        add_zoom_options()
+    add_theme_options()
     
     # Clear previous run's headers
     reset_toc_registry(toc_config)
@@ -51,42 +76,83 @@ def st_book(module_list, toc_config: TOCConfig = None, *args, **kwargs):
         toc_title_style = toc_config.title_style
         toc_content_style = toc_config.content_style
 
-    # Run the blocks (potentially populating the ToC registry)
-    for i, module in enumerate(module_list):
+    # In lazy mode, only the first blocks are rendered
+    config = get_book_config()
+    loaded = len(module_list)
+    if config.lazy_blocks is not None and not exporting:
+        loaded = loaded_block_count(len(module_list), config.lazy_blocks)
+    # False if some blocks which aren't loaded have never been rendered: their ToC entries are unknown
+    toc_known = True
+
+    # Prefetch the previews of the book's external links in the background (sqlite3 and html.parser take a while to import)
+    from .previews import prefetching_links, add_link_previews
+    previewed_links = prefetching_links(module_list) if config.link_previews and not exporting else nullcontext({})
+
+    # Collect the CSS of all containers into a single stylesheet
+    with book_stylesheet() as sheet, previewed_links as links:
+        
+        # Run the blocks (potentially populating the ToC registry)
+        for i, module in enumerate(module_list):
+            
+            # Blocks which aren't loaded yet still contribute the ToC entries they had when last rendered
+            if i >= loaded:
+                if use_toc_block and i == toc_pos:
+                    register_toc_entry(toc_title, '1')
+                toc_known = toc_known and register_block_toc(module)
+                continue
+            
+            # Generate Toc at appropriate position
+            if use_toc_block and i == toc_pos:
+                toc_block = st_toc(toc_title_style)
+            
+            # TODO: Wrap block in a way to trace it back to module name
+            with recording_block_toc(module):
+                if exporting and i in document.rendered_blocks:
+                    with key_scope(module.__name__):
+                        replay(document.rendered_blocks[i])
+                elif config.fragment_blocks and not exporting:
+                    st_include_fragment(module, *args, **kwargs)
+                else:
+                    st_include(module, *args, **kwargs)
+            write_new_rules()
+            st_space("v","70px")
+        
+        if loaded < len(module_list):
+            st_load_more(loaded, len(module_list), config.lazy_blocks)
         
         # Generate Toc at appropriate position
-        if use_toc_block and i == toc_pos:
-            toc_block = st_toc(toc_title_style)
+        if use_toc_block and toc_pos == len(module_list):
+            if loaded < len(module_list):
+                register_toc_entry(toc_title, '1')
+            else:
+                toc_block = st_toc(toc_title_style)
         
-        # TODO: Wrap block in a way to trace it back to module name
-        st_include(module, *args, **kwargs)
-        st_space("v","70px")
+        # Fill the ToC placeholder
+        if use_toc_sidebar:
+            populate_toc(toc_sidebar, toc_block, toc_content_style, complete=toc_known)
     
-    # Generate Toc at appropriate position
-    if use_toc_block and toc_pos == len(module_list):
-        toc_block = st_toc(toc_title_style)
-    
-    # Fill the ToC placeholder
-    if use_toc_sidebar:
-        populate_toc(toc_sidebar, toc_block, toc_content_style)
+    # Give the hover card the previews fetched so far
+    add_link_previews(links)
         
     end_time = time.time()
     duration = end_time - start_time
     print(f"st_book function completed in {duration:.2f} seconds.")
+    if sheet is not None:
+        print(f"Stylesheet: {len(sheet.rules)} rules, {sheet.collapsed} of {sheet.added} collapsed.")
 
 
 def load_css(file_name: str):
     """Loads a CSS file and injects it into the StreamTeX app."""
     try:
         with resources.open_text('streamtex.static', file_name) as f:
-            st.html(f'<style>{f.read()}</style>')
+            backend().html(f'<style>{f.read()}</style>')
     except:
         current_dir = os.path.dirname(__file__)
         static_dir = os.path.join(current_dir, 'static')
         css_file_path = os.path.join(static_dir, file_name)
         # Read the CSS file
         with open(css_file_path, 'r') as f:
-            st.html(f'<style>{f.read()}</style>')
+            backend().html(f'<style>{f.read()}</style>')
 
 def add_zoom_options():
     """Adds a generic 'View Options' menu to the sidebar using a popover."""
@@ -259,19 +325,24 @@ def inject_zoom_logic(zoom_setting):
     </style>
     """
     
-    st.html(css)
-    st.html(js_logic, unsafe_allow_javascript=True)
+    backend().html(css)
+    backend().html(js_logic, unsafe_allow_javascript=True)
        
 def build_ToC_sidebar_placeholder():
-    with st.sidebar:
-        st.header("Table of Contents")
-        toc_sidebar = st.empty()
+    page = backend()
+    with page.sidebar:
+        page.header(toc_title)
+        toc_sidebar = page.empty()
     
     return toc_sidebar
 
-def populate_toc(toc_sidebar: Delta, toc_block: Delta=None, toc_content_style: Style =None):
+toc_incomplete_note = "More sections appear as the book loads."
+'''Ends the ToC while the entries of some blocks (not loaded in lazy mode) are unknown.'''
+
+def populate_toc(toc_sidebar: Delta, toc_block: Delta=None, toc_content_style: Style =None, complete: bool = True):
     toc_entry_list = toc_entries()
     indent_char="&nbsp;"
+    incomplete_note = f"<span style=\"opacity: 0.6; font-style: italic;\">{toc_incomplete_note}</span>"
         
     with toc_sidebar.container():
         for entry in toc_entry_list:
@@ -279,10 +350,12 @@ def populate_toc(toc_sidebar: Delta, toc_block: Delta=None, toc_content_style: S
             indent = indent_char * (entry['level'] - 1) * 4
             
             # Native Streamlit Link to ID
-            st.html(
+            backend().html(
                 f"<span style=\"overflow: hidden; text-overflow: ellipsis; text-wrap: nowrap; word-wrap: normal;\">"
                 f"{indent}<a href=\"#{entry['key_anchor']}\">{entry['title']}</a></span>"
             )
+        if not complete:
+            backend().html(incomplete_note)
     if toc_block is not None:
         with toc_block.container():
             for entry in toc_entry_list:
@@ -290,24 +363,93 @@ def populate_toc(toc_sidebar: Delta, toc_block: Delta=None, toc_content_style: S
                 st_write(toc_content_style, f"{indent}{entry['title']}",
                                 link=f"#{entry['key_anchor']}", hover=False, no_link_decor=True)
                 st_br()
+            if not complete:
+                backend().html(incomplete_note)
                 
                 
             
             
 def st_toc(toc_title_style):
-    st_write(toc_title_style, "Table of Contents", tag=Tags.div, toc_lvl='1')
+    st_write(toc_title_style, toc_title, tag=Tags.div, toc_lvl='1')
     st_space("v",4)
-    toc_block = st.empty()
+    toc_block = backend().empty()
     st_space("v","70px")
     return toc_block
 
 def st_include(block_file_module, *args, **kwargs):
     if not block_file_module:
-        st.markdown(f":red-background[File {block_file_module.__path__} not found]")
+        backend().markdown(f":red-background[File {block_file_module.__path__} not found]")
         return
 
     if not hasattr(block_file_module, 'build'):
-        st.markdown(f":red-background[The file {block_file_module.__path__} does not contain a build() function.]")
+        backend().markdown(f":red-background[The file {block_file_module.__path__} does not contain a build() function.]")
         return 
     
-    block_file_module.build(*args, **kwargs)
\ No newline at end of file
+    # Number the block's keys on their own so they stay stable across reruns, and
+    # coalesce its consecutive st_* outputs into as few st.html elements as possible
+    with key_scope(block_file_module.__name__), html_buffer():
+        build = lambda: block_file_module.build(*args, **kwargs)
+
+        if active_recorder() is not None:
+            # Part of an enclosing block being recorded: its output is cached with it
+            record_dependency(block_file_module.__file__)
+            build()
+        elif get_book_config().render_cache and getattr(block_file_module, "render_cache", True):
+            render_cached(_render_key(block_file_module, args, kwargs), build)
+        else:
+            build()
+
+
+
+def st_include_fragment(block_file_module, *args, **kwargs):
+    """
+    Includes a block as a Streamlit fragment, so that interacting with its widgets only reruns this block.
+
+    Fragment reruns happen outside of st_book: the options, themes, key scope and ToC numbering the block
+    was included with are captured here, and restored when it reruns. If a rerun changes the entries the
+    block adds to the ToC, the whole book is rerun to rebuild it.
+    """
+    config = get_book_config()
+    theme, themes = styles.theme, styles.themes
+    scope = fork_key_scope()
+    start = toc_state()
+    toc_config = current_toc_config()
+    # The ToC entries added by the block during the full run
+    captured = None
+
+    @st.fragment
+    def block_fragment():
+        nonlocal captured
+        if captured is None:
+            # 1. Full run: the block adds its entries to the book's ToC
+            first = len(toc_entries()) if start is not None else 0
+            with block_stylesheet():
+                st_include(block_file_module, *args, **kwargs)
+            captured = toc_entries()[first:] if start is not None else []
+            return
+
+        # 2. Fragment rerun: the block is rendered from the state it was included with
+        set_book_config(config)
+        styles.theme, styles.themes = theme, themes
+        with resumed_key_scope(scope), resumed_toc(start, toc_config) as registry, block_stylesheet():
+            st_include(block_file_module, *args, **kwargs)
+
+        if registry is not None and registry.get_entries() != captured:
+            st.rerun()
+
+    block_fragment()
+
+
+def _render_key(block_file_module, args, kwargs):
+    """Returns the key of a block's output in the render cache: everything its output depends on."""
+    return (
+        block_file_module.__name__,
+        source_hash(block_file_module),
+        current_key_scope().name,
+        toc_state(),
+        tuple(sorted((k, str(v)) for k, v in styles.theme.items())),
+        # Styles overridden by switchable themes are written with variables, whatever the selected theme
+        tuple(sorted({style_id for t in styles.themes.values() for style_id in t})),
+        repr(get_book_config()),
+        repr((args, sorted(kwargs.items()))),
+    )
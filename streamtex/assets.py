@@ -0,0 +1,344 @@
+import io
+import os
+import base64
+import shutil
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import quote
+
+from .cache import LRUCache, _file_stamp, record_incomplete
+
+assets_dir = os.path.join("static", "stx-assets")
+'''The folder local files are published to, relative to the project folder. Streamlit serves it at app/static/stx-assets.'''
+
+variant_widths = (320, 640, 960, 1280, 1920, 2560)
+'''The widths in pixels of the downscaled copies of images offered to browsers.'''
+
+image_mime_types = {"avif": "image/avif", "webp": "image/webp"}
+'''The MIME types of the modern formats images can be converted to.'''
+
+_hashes = LRUCache(1024)
+'''The content hashes of local files, keyed by (absolute path, mtime, size), shared by all sessions.'''
+
+placeholder_width = 16
+'''The width in pixels of the blurred placeholders shown while images load.'''
+
+_headers = LRUCache(1024)
+'''The (width, height, animated, format) of local images as browsers display them (None if unreadable), keyed by (absolute path, mtime, size).'''
+
+_placeholders = LRUCache(1024)
+'''The data URIs of the placeholders of local images (None if they have none), keyed by (absolute path, mtime, size).'''
+
+
+def _file_key(file_path: str) -> Optional[tuple]:
+    path = os.path.abspath(file_path)
+    stamp = _file_stamp(path)
+    return (path,) + stamp if stamp is not None else None
+
+
+def _content_hash(key: tuple) -> str:
+    # Files which haven't changed since they were last hashed aren't read again
+    content_hash = _hashes.get(key)
+    if content_hash is None:
+        digest = hashlib.sha256()
+        with open(key[0], "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(chunk)
+        content_hash = digest.hexdigest()[:16]
+        _hashes.put(key, content_hash)
+    return content_hash
+
+
+def asset_name(path: str, content_hash: str, suffix: str = "", extension: str = None) -> str:
+    """Returns the name a file is published under, e.g. "photo-0123456789abcdef.jpg"."""
+    stem, original_extension = os.path.splitext(os.path.basename(path))
+    return f"{stem}-{content_hash}{suffix}{extension or original_extension.lower()}"
+
+
+def asset_url(name: str) -> str:
+    return f"app/static/stx-assets/{quote(name)}"
+
+
+def _write_asset(target: str, write: Callable[[str], None]):
+    """Writes a published file with `write(temporary path)`, then renames it, so that the server never serves a partial file."""
+    folder = os.path.dirname(target)
+    if not os.path.isdir(folder):
+        os.makedirs(folder, exist_ok=True)
+        # The published files are generated: they are kept out of the project's repository
+        with open(os.path.join(folder, ".gitignore"), "w") as file:
+            file.write("*\n")
+
+    descriptor, temporary = tempfile.mkstemp(dir=folder, prefix=".tmp-")
+    os.close(descriptor)
+    try:
+        write(temporary)
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, target)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def publish_asset(file_path: str) -> Optional[str]:
+    """
+    Publishes a local file to the project's static files under a name derived from its content,
+    and returns its URL. Returns None if the file can't be read or published.
+
+    The URL changes with the content of the file, so browsers may cache it for good.
+    """
+    key = _file_key(file_path)
+    if key is None:
+        return None
+    try:
+        name = asset_name(key[0], _content_hash(key))
+        target = os.path.join(os.getcwd(), assets_dir, name)
+        if not os.path.exists(target):
+            # Copied (not hardlinked: editing the source in place would change a file named by its content)
+            _write_asset(target, lambda temporary: shutil.copyfile(key[0], temporary))
+    except OSError as e:
+        print(f"Error publishing {file_path}: {e}")
+        return None
+    return asset_url(name)
+
+
+def _image_header(file_path: str) -> Optional[tuple]:
+    key = _file_key(file_path)
+    if key is None:
+        return None
+    header = _headers.get(key, default=0)
+    if header != 0:
+        return header
+
+    try:
+        # Pillow is optional: without it, images are served as they are
+        from PIL import Image
+    except ImportError:
+        return None
+
+    header = None
+    try:
+        # Only the header is read
+        with Image.open(key[0]) as image:
+            # Browsers apply the EXIF orientation: images turned by a quarter have their width and height swapped
+            turned = image.getexif().get(0x0112) in (5, 6, 7, 8)
+            width, height = (image.height, image.width) if turned else image.size
+            header = (width, height, getattr(image, "n_frames", 1) > 1, image.format)
+    except (OSError, ValueError):
+        pass
+    _headers.put(key, header)
+    return header
+
+
+def image_size(file_path: str) -> Optional[Tuple[int, int]]:
+    """
+    Returns the (width, height) in pixels of a local image as browsers display it,
+    or None if it can't be read (or Pillow isn't installed).
+    """
+    header = _image_header(file_path)
+    return header[:2] if header is not None else None
+
+
+def image_width(file_path: str) -> Optional[int]:
+    """
+    Returns the width in pixels of a local image as browsers display it,
+    or None if it can't have downscaled variants (Pillow isn't installed, animated or unreadable image).
+    """
+    header = _image_header(file_path)
+    return header[0] if header is not None and not header[2] else None
+
+
+def image_placeholder(file_path: str) -> Optional[str]:
+    """
+    Returns a tiny, blurred copy of a local image as a data URI, to be shown while the image loads.
+    Returns None for images with transparency, which would show it through, and if it can't be generated.
+    """
+    key = _file_key(file_path)
+    if key is None:
+        return None
+    placeholder = _placeholders.get(key, default=0)
+    if placeholder != 0:
+        return placeholder
+
+    placeholder = None
+    try:
+        from PIL import Image, ImageFilter, ImageOps
+
+        with Image.open(key[0]) as image:
+            if image.mode not in ("RGBA", "LA", "PA") and "transparency" not in image.info:
+                # JPEGs are decoded at a fraction of their size
+                image.draft("RGB", (4 * placeholder_width, 4 * placeholder_width))
+                image = ImageOps.exif_transpose(image).convert("RGB")
+                image.thumbnail((placeholder_width, placeholder_width))
+                image = image.filter(ImageFilter.GaussianBlur(1))
+
+                buffer = io.BytesIO()
+                image.save(buffer, format="JPEG", quality=50, optimize=True)
+                placeholder = "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+    except ImportError:
+        return None
+    except (OSError, ValueError):
+        pass
+    _placeholders.put(key, placeholder)
+    return placeholder
+
+
+def image_widths(source_width: int, display_width: float = None) -> List[int]:
+    """
+    Returns the widths of the downscaled copies of an image of `source_width` pixels: the widths below it,
+    up to the one covering twice `display_width` CSS pixels (for high density screens), if it is given.
+    """
+    widths = []
+    for width in variant_widths:
+        if width >= source_width:
+            break
+        widths.append(width)
+        if display_width is not None and width >= 2 * display_width:
+            break
+    return widths
+
+
+def image_variant(file_path: str, width: Optional[int], image_format: str = None, quality: int = 75,
+                  wait: bool = True) -> Optional[str]:
+    """
+    Returns the URL of a copy of a local image downscaled to `width` pixels (None: full size),
+    converted to `image_format` ("avif", "webp") at `quality` if it is given, generating it if it doesn't exist yet.
+    Returns None if it can't be generated, or if it isn't smaller than the image (e.g. a palette PNG resized in full color).
+
+    If `wait` is False, a copy which doesn't exist yet is generated in a background thread, and None is returned
+    until it is ready: the block being rendered isn't cached, so that the next run offers it.
+
+    The copies are named after the content of the image and how they are made, so they are only generated once.
+    """
+    key = _file_key(file_path)
+    if key is None:
+        return None
+    try:
+        name = _variant_name(key, width, image_format, quality)
+        target = os.path.join(os.getcwd(), assets_dir, name)
+        if not os.path.exists(target):
+            if not wait:
+                record_incomplete()
+                _convert_in_background(key[0], width, image_format, quality, target)
+                return None
+            _write_asset(target, lambda temporary: _convert(key[0], width, image_format, quality, temporary))
+        size = os.path.getsize(target)
+    except (ImportError, OSError, ValueError) as e:
+        print(f"Error converting {file_path}: {e}")
+        return None
+    return asset_url(name) if size < key[2] else None
+
+
+converter_workers = min(4, os.cpu_count() or 1)
+'''The number of threads generating copies of images in the background, shared by all sessions.'''
+
+_converting: Set[str] = set()
+'''The paths of the copies being generated in the background, or waiting to be.'''
+_converting_lock = threading.Lock()
+_converter: Optional[ThreadPoolExecutor] = None
+
+
+def _convert_in_background(path: str, width: Optional[int], image_format: Optional[str], quality: int, target: str):
+    """Starts generating a copy of an image in a background thread, unless it is already being generated."""
+    global _converter
+    with _converting_lock:
+        if target in _converting:
+            return
+        _converting.add(target)
+        if _converter is None:
+            _converter = ThreadPoolExecutor(converter_workers, thread_name_prefix="stx-images")
+    _converter.submit(_convert_later, path, width, image_format, quality, target)
+
+
+def _convert_later(path: str, width: Optional[int], image_format: Optional[str], quality: int, target: str):
+    try:
+        if not os.path.exists(target):
+            _write_asset(target, lambda temporary: _convert(path, width, image_format, quality, temporary))
+    except (ImportError, OSError, ValueError) as e:
+        print(f"Error converting {path}: {e}")
+    finally:
+        with _converting_lock:
+            _converting.discard(target)
+
+
+def _variant_name(key: tuple, width: Optional[int], image_format: Optional[str], quality: int) -> str:
+    suffix = f"-{width}w" if width else ""
+    if image_format is None:
+        return asset_name(key[0], _content_hash(key), suffix)
+    return asset_name(key[0], _content_hash(key), f"{suffix}-q{quality}", f".{image_format}")
+
+
+def image_transcode(file_path: str, image_format: str, quality: int = 75) -> Optional[str]:
+    """
+    Returns the URL of a local image converted to `image_format` ("avif", "webp"), generating it if it doesn't exist yet.
+    Returns None if it can't be converted (see `can_transcode`), or if the converted image isn't smaller than the original.
+    """
+    if not can_transcode(file_path, image_format):
+        return None
+    return image_variant(file_path, None, image_format, quality)
+
+
+def can_transcode(file_path: str, image_format: str) -> bool:
+    """
+    Returns True if a local image can be converted to `image_format` ("avif", "webp"): Pillow can read it and write the format.
+
+    Lossless images (PNG, GIF) are converted to lossless WebP, and not to AVIF, which would blur their edges.
+    """
+    header = _image_header(file_path)
+    if header is None or header[2] or not can_write(image_format):
+        return False
+    return not (image_format == "avif" and header[3] in ("PNG", "GIF"))
+
+
+_writable_formats: Dict[str, bool] = {}
+
+
+def can_write(image_format: str) -> bool:
+    """Returns True if Pillow is installed and can write images in `image_format` ("avif", "webp")."""
+    if image_format not in _writable_formats:
+        try:
+            from PIL import features
+            _writable_formats[image_format] = image_format in image_mime_types and bool(features.check(image_format))
+        except ImportError:
+            _writable_formats[image_format] = False
+    return _writable_formats[image_format]
+
+
+def _convert(path: str, width: Optional[int], image_format: Optional[str], quality: int, target: str):
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as image:
+        original_format = image.format
+        icc_profile = image.info.get("icc_profile")
+
+        # 1. Turn the image as browsers display it: the copy has no EXIF orientation
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ("1", "P"):
+            # Palette images are resized in full color
+            image = image.convert("RGBA")
+
+        # 2. Resize, keeping the aspect ratio
+        if width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.Resampling.LANCZOS)
+
+        # 3. Save in the format of the original, or the one asked for
+        options = {"icc_profile": icc_profile} if icc_profile else {}
+        if image_format is None:
+            image_format = original_format
+            if image_format == "JPEG":
+                options.update(quality=85, optimize=True, progressive=True)
+        else:
+            image_format = image_format.upper()
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "A" in image.mode else "RGB")
+            if image_format == "WEBP" and original_format in ("PNG", "GIF"):
+                options.update(lossless=True)
+            elif image_format == "AVIF":
+                # The default speed takes about 5 times longer, for images about 4% smaller
+                options.update(quality=quality, speed=8)
+            else:
+                options.update(quality=quality)
+        image.save(target, format=image_format, **options)
@@ -0,0 +1,169 @@
+import re
+import html as html_lib
+import streamlit as st
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Union
+
+
+class HtmlNode:
+    """
+    A container of an `HtmlDocument`, offering the part of Streamlit's DeltaGenerator API StreamTeX uses.
+
+    Like a DeltaGenerator, it is used as a Context Manager to write into it.
+    """
+    def __init__(self, document: "HtmlDocument", key: str = None, tag: str = "div", classes: str = "stVerticalBlock"):
+        self.document = document
+        self.key = key
+        '''The key of the container, which Streamlit adds to its classes.'''
+        self.tag = tag
+        self.classes = classes
+        self.children: List[Union[str, "HtmlNode", "_HtmlPlaceholder"]] = []
+        '''The HTML of the elements and the containers inside this one, in order.'''
+
+    def html(self, body: str, unsafe_allow_javascript: bool = False):
+        # Like Streamlit, style-only elements don't take a place in the page
+        if _only_style_tags(body):
+            self.document.head.append(body)
+        else:
+            self.children.append(body)
+        return self
+
+    def markdown(self, body: str):
+        return self.html(f"<div>{html_lib.escape(body)}</div>")
+
+    def header(self, body: str):
+        return self.html(f"<h2>{html_lib.escape(body)}</h2>")
+
+    def container(self, key: str = None) -> "HtmlNode":
+        node = HtmlNode(self.document, key)
+        self.children.append(node)
+        return node
+
+    def empty(self) -> "_HtmlPlaceholder":
+        """Returns a placeholder, which the elements written to it replace."""
+        return _HtmlPlaceholder(self)
+
+    def __enter__(self):
+        self.document._stack.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        self.document._stack.pop()
+        return False
+
+    def render(self) -> str:
+        classes = self.classes + (f" st-key-{self.key}" if self.key else "")
+        chunks = []
+        for child in self.children:
+            if isinstance(child, _HtmlPlaceholder):
+                child = child.content
+            if child is None:
+                continue
+            if isinstance(child, HtmlNode):
+                chunks.append(child.render())
+            else:
+                chunks.append(
+                    '<div class="stElementContainer element-container" data-testid="stElementContainer">'
+                    f'<div class="stHtml" data-testid="stHtml">{child}</div></div>'
+                )
+        return f'<{self.tag} class="{classes}" data-testid="{self.classes.split()[0]}">{"".join(chunks)}</{self.tag}>'
+
+
+class _HtmlPlaceholder:
+    """The equivalent of `st.empty()`: holds a single element, replaced by each write."""
+    def __init__(self, parent: HtmlNode):
+        self.document = parent.document
+        self.content: Union[None, str, HtmlNode] = None
+        '''The element or container held by the placeholder.'''
+        parent.children.append(self)
+
+    def html(self, body: str, unsafe_allow_javascript: bool = False):
+        self.content = body
+        return self
+
+    def container(self, key: str = None) -> HtmlNode:
+        self.content = HtmlNode(self.document, key)
+        return self.content
+
+
+class HtmlDocument:
+    """
+    An in-memory page, which the st_* functions write to instead of Streamlit while it is active.
+
+    It reproduces the structure and classes of the DOM Streamlit builds, so the same CSS (default.css,
+    the container rules keyed by `container_selector`, the zoom logic) applies to the rendered page.
+    """
+    def __init__(self, title: str = "StreamTeX", capture_only: bool = False):
+        self.title = title
+        self.capture_only = capture_only
+        '''If True, st_book doesn't render anything: it only stores its arguments in `book`.'''
+        self.book: Optional[tuple] = None
+        '''The (module_list, toc_config, args, book_config, kwargs) st_book was called with, in capture mode.'''
+        self.rendered_blocks: Dict[int, list] = {}
+        '''The recorded output of blocks rendered ahead (e.g. by worker processes), by index in the module list.'''
+        self.head: List[str] = []
+        '''The style-only elements, written in the <head> of the page.'''
+        self.body_classes: List[str] = ["stApp", "stx-static"]
+        '''The classes of the <body> of the page.'''
+        self.main = HtmlNode(self)
+        '''The main content of the page.'''
+        self.sidebar = HtmlNode(self, tag="section", classes="stSidebar")
+        '''The sidebar of the page, holding the ToC.'''
+        self._stack: List[HtmlNode] = [self.main]
+
+    @property
+    def current(self) -> HtmlNode:
+        return self._stack[-1]
+
+    def html(self, body: str, unsafe_allow_javascript: bool = False):
+        return self.current.html(body, unsafe_allow_javascript)
+
+    def markdown(self, body: str):
+        return self.current.markdown(body)
+
+    def header(self, body: str):
+        return self.current.header(body)
+
+    def container(self, key: str = None) -> HtmlNode:
+        return self.current.container(key)
+
+    def empty(self):
+        return self.current.empty()
+
+    def render(self) -> str:
+        head = "\n".join(self.head)
+        return (
+            "<!DOCTYPE html>\n"
+            f'<html>\n<head>\n<meta charset="utf-8">\n<title>{html_lib.escape(self.title)}</title>\n{head}\n</head>\n'
+            f'<body class="{" ".join(self.body_classes)}">\n{self.sidebar.render()}\n'
+            '<section class="stMain" data-testid="stMain">'
+            '<div class="block-container stMainBlockContainer" data-testid="stMainBlockContainer">'
+            f"{self.main.render()}</div></section>\n</body>\n</html>\n"
+        )
+
+
+def _only_style_tags(body: str) -> bool:
+    body = re.sub(r"<!--.*?-->", "", body, flags=re.DOTALL)
+    return re.sub(r"<style[^>]*>.*?</style>", "", body, flags=re.DOTALL | re.IGNORECASE).strip() == ""
+
+
+_active_document: ContextVar[Optional[HtmlDocument]] = ContextVar("html_document", default=None)
+
+
+def active_document() -> Optional[HtmlDocument]:
+    """Returns the HTML document being rendered, if any."""
+    return _active_document.get()
+
+
+def backend():
+    """
+    Returns what the st_* functions write to: the HTML document being rendered if there is one,
+    otherwise Streamlit itself.
+    """
+    document = _active_document.get()
+    return document if document is not None else st
+
+
+def set_active_document(document: Optional[HtmlDocument]):
+    """Makes the st_* functions write to `document` instead of Streamlit. `None` writes to Streamlit again."""
+    _active_document.set(document)
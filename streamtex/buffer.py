@@ -0,0 +1,144 @@
+import streamlit as st
+from streamlit.delta_generator import DeltaGenerator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from typing import List, Literal, Optional, Tuple
+
+from .config import get_book_config
+from .cache import recorded_write
+from .backend import backend, active_document, _only_style_tags
+
+HtmlFlow = Literal["column", "row"]
+
+_active_buffer: ContextVar[Optional["HtmlBuffer"]] = ContextVar("html_buffer", default=None)
+_html_flow: ContextVar[HtmlFlow] = ContextVar("html_flow", default="column")
+
+
+def cursor_position() -> Optional[Tuple]:
+    """
+    Returns the position at which the next element will be written, or None if it can't be tracked
+    (bare mode, or writing into a placeholder, whose cursor never moves).
+    """
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return None
+    cursor = st._main._active_dg._cursor
+    if cursor is None or cursor.is_locked:
+        return None
+    return (cursor.root_container, cursor.parent_path, cursor.index)
+
+
+def reserve_slot():
+    """
+    Takes the position of the next element of the active container without writing anything there yet,
+    and returns the placeholder writing to it. Unlike st.empty(), the element shown at that position by
+    the previous run stays as it is until the placeholder is written to.
+    """
+    dg = st._main._active_dg
+    cursor = dg._cursor.get_locked_cursor(delta_type="html", add_rows_metadata=None)
+    return DeltaGenerator(root_container=dg._root_container, cursor=cursor, parent=dg)
+
+
+class HtmlBuffer:
+    """
+    Coalesces consecutive HTML fragments written at the same position of the page into one st.html element.
+
+    The position of a group is reserved when its first fragment is emitted, but nothing is sent until the
+    group is closed: each group is written once per run, so a rerun producing the same page sends the same
+    elements, and the browser never shows a group cut to its first fragment. The cost is that the fragments
+    of a group only show up once it is closed, when something else is written or the block ends.
+    Following fragments are only accumulated as long as nothing else (a native Streamlit element,
+    a container, ...) has been written in between, which is detected through the position of the active
+    container's cursor.
+    """
+    def __init__(self):
+        self.fragments: List[str] = []
+        '''The fragments of the currently open group.'''
+        self.flow: HtmlFlow = "column"
+        '''How the fragments of the open group are laid out.'''
+        self.slot = None
+        '''The placeholder at the position of the open group.'''
+        self.position = None
+        '''The cursor position expected for the next fragment to join the open group.'''
+
+    def emit(self, html: str):
+        if _only_style_tags(html):
+            # Style-only elements don't take a place in the page (Streamlit sends them aside): the group goes on
+            st.html(html)
+            return
+
+        position = cursor_position()
+        if position is None:
+            self.flush()
+            st.html(html)
+            return
+
+        if self.fragments and position == self.position:
+            self.fragments.append(html)
+            return
+
+        # Something else was written since the last fragment: start a new group
+        self.flush()
+        self.flow = _html_flow.get()
+        self.slot = reserve_slot()
+        self.fragments = [html]
+        self.position = cursor_position()
+
+    def flush(self):
+        """Writes the open group to its position."""
+        if len(self.fragments) == 1:
+            self.slot.html(self.fragments[0])
+        elif self.fragments:
+            self.slot.html(join_html(self.fragments, self.flow))
+        self.fragments = []
+        self.slot = None
+        self.position = None
+
+
+def join_html(fragments: List[str], flow: HtmlFlow = "column") -> str:
+    """
+    Joins fragments into a single HTML string which lays them out like separate st.html elements would be.
+    """
+    chunks = "".join(f"<div>{fragment}</div>" for fragment in fragments)
+    return f'<div class="stx-html-group stx-{flow}">{chunks}</div>'
+
+
+@recorded_write("html")
+def emit_html(html: str):
+    """
+    Writes an HTML string to the page, through the active block buffer if there is one.
+    """
+    buffer = _active_buffer.get()
+    if buffer is None:
+        backend().html(html)
+    else:
+        buffer.emit(html)
+
+
+@contextmanager
+def html_buffer():
+    """
+    A Context Manager buffering the HTML emitted by the st_* functions until it exits.
+    Nested uses share the outermost buffer.
+    """
+    if _active_buffer.get() is not None or not get_book_config().buffered_html or active_document() is not None:
+        yield
+        return
+
+    buffer = HtmlBuffer()
+    token = _active_buffer.set(buffer)
+    try:
+        yield
+    finally:
+        buffer.flush()
+        _active_buffer.reset(token)
+
+
+@contextmanager
+def html_flow(flow: HtmlFlow):
+    """A Context Manager setting how coalesced fragments are laid out inside a container."""
+    token = _html_flow.set(flow)
+    try:
+        yield
+    finally:
+        _html_flow.reset(token)
@@ -0,0 +1,325 @@
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+
+
+class LRUCache:
+    """
+    A thread-safe, size-bounded mapping evicting its least recently used entries, with hit/miss counters.
+
+    Shared by all sessions of the server process.
+    """
+    def __init__(self, max_entries: int = 256, max_size: Optional[int] = None):
+        self.max_entries = max_entries
+        '''The maximum number of entries kept.'''
+        self.max_size = max_size
+        '''The maximum total `len()` of the values kept (e.g. bytes of data URIs), or None for no limit.'''
+        self.size = 0
+        '''The total `len()` of the values kept, if `max_size` is set.'''
+        self.hits = 0
+        '''The number of lookups that found an entry.'''
+        self.misses = 0
+        '''The number of lookups that didn't.'''
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            if self.max_size is not None:
+                if len(value) > self.max_size:
+                    return
+                if key in self._entries:
+                    self.size -= len(self._entries[key])
+                self.size += len(value)
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries or (self.max_size is not None and self.size > self.max_size):
+                _, evicted = self._entries.popitem(last=False)
+                if self.max_size is not None:
+                    self.size -= len(evicted)
+
+    def discard(self, key: Hashable):
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None and self.max_size is not None:
+                self.size -= len(value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+########################################################################
+# Block render cache
+
+Op = Tuple
+'''A recorded operation: ("html", html), ("css", rules), ("class", css), ("enter", key, flow),
+("exit",) or ("toc", label, level).'''
+
+
+class Recorder:
+    """
+    Records the operations a block performs through StreamTeX, so they can be replayed without running it.
+
+    Anything the block writes to the page by other means (native Streamlit elements, widgets, raw
+    containers) moves the cursor of a container behind the recorder's back, which makes the recording
+    invalid: such blocks are never cached.
+    """
+    def __init__(self):
+        self.ops: List[Op] = []
+        '''The recorded operations, in order.'''
+        self.dependencies = set()
+        '''Paths of the files read by the block (images, nested blocks), checked before each replay.'''
+        self.valid = True
+        '''False if the block wrote something that can't be replayed, or if its output isn't final.'''
+        self._stack: List[Tuple] = []
+        self._positions: Dict[Tuple, int] = {}
+        self._roots: Dict[int, int] = {}
+
+    def start(self):
+        from .buffer import cursor_position
+        position = cursor_position()
+        if position is None:
+            self.valid = False
+            return
+        self._stack = [position[:2]]
+        self._positions = {position[:2]: position[2]}
+        self._roots = _root_indices()
+
+    def check(self):
+        """Checks that nothing was written since the last recorded operation."""
+        from .buffer import cursor_position
+        position = cursor_position()
+        if (position is None or not self._stack or position[:2] != self._stack[-1]
+                or self._positions.get(position[:2]) != position[2]):
+            self.valid = False
+
+    def sync(self):
+        """Remembers the position reached by a recorded operation."""
+        from .buffer import cursor_position
+        position = cursor_position()
+        if position is None:
+            self.valid = False
+        elif self._stack:
+            self._positions[self._stack[-1]] = position[2]
+
+    def enter(self):
+        """Called inside a container that was just created by a recorded operation."""
+        from .buffer import cursor_position
+        position = cursor_position()
+        if position is None or not self._stack:
+            self.valid = False
+            return
+        self._positions[self._stack[-1]] += 1
+        self._stack.append(position[:2])
+        self._positions[position[:2]] = position[2]
+
+    def leave(self):
+        """Called before leaving a container created by a recorded operation."""
+        self.check()
+        if self._stack:
+            self._stack.pop()
+
+    def stop(self):
+        """Checks that nothing was written at the end of the block, nor in other parts of the page."""
+        if not self.valid:
+            return
+        self.check()
+        for root, index in _root_indices().items():
+            if (root, ()) != self._stack[0] and self._roots.get(root, 0) != index:
+                self.valid = False
+
+
+def _root_indices() -> Dict[int, int]:
+    """
+    Returns the cursor index of each top-level container (main, sidebar, ...) of the page.
+    The event container is left out: style-only st.html elements are sent there.
+    """
+    from streamlit.proto.RootContainer_pb2 import RootContainer
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return {}
+    return {root: cursor.index for root, cursor in ctx.cursors.items() if root != RootContainer.EVENT}
+
+
+_active_recorder: ContextVar[Optional[Recorder]] = ContextVar("recorder", default=None)
+
+
+def active_recorder() -> Optional[Recorder]:
+    """Returns the recorder of the block being recorded, if any."""
+    return _active_recorder.get()
+
+
+def record(*op):
+    """Records an operation which doesn't write to the page (CSS rules, ToC entries, links)."""
+    recorder = _active_recorder.get()
+    if recorder is not None:
+        recorder.ops.append(op)
+
+
+def record_dependency(path: str):
+    """Records a file the output of the block being recorded depends on."""
+    recorder = _active_recorder.get()
+    if recorder is not None:
+        recorder.dependencies.add(os.path.abspath(path))
+
+
+def record_incomplete():
+    """
+    Records that the output of the block being recorded isn't final (e.g. it waits for files generated in the
+    background): it isn't cached, so that the block is rendered again by the next run.
+    """
+    recorder = _active_recorder.get()
+    if recorder is not None:
+        recorder.valid = False
+
+
+def recorded_write(kind: str):
+    """Decorator recording each call of a function writing to the page as a `(kind, *args)` operation."""
+    def decorator(func: Callable):
+        @wraps(func)
+        def wrapper(*args):
+            recorder = _active_recorder.get()
+            if recorder is None:
+                return func(*args)
+            recorder.check()
+            result = func(*args)
+            recorder.ops.append((kind, *args))
+            recorder.sync()
+            return result
+        return wrapper
+    return decorator
+
+
+def _file_stamp(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+_source_hashes = LRUCache(1024)
+
+
+def source_hash(module) -> str:
+    """Returns a hash of the source file of a module, memoized on the file's modification time and size."""
+    path = getattr(module, "__file__", None)
+    stamp = _file_stamp(path) if path else None
+    if stamp is None:
+        return ""
+
+    key = (path, stamp)
+    digest = _source_hashes.get(key)
+    if digest is None:
+        with open(path, "rb") as f:
+            digest = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+        _source_hashes.put(key, digest)
+    return digest
+
+
+class RenderEntry:
+    """The recorded output of a block."""
+    def __init__(self, ops: List[Op], dependencies: Dict[str, Optional[Tuple[int, int]]]):
+        self.ops = ops
+        self.dependencies = dependencies
+
+    def is_fresh(self) -> bool:
+        return all(_file_stamp(path) == stamp for path, stamp in self.dependencies.items())
+
+
+render_cache = LRUCache(512)
+'''The recorded output of blocks, shared by all sessions.'''
+
+
+def replay(ops: List[Op]):
+    """
+    Performs recorded operations again.
+
+    ToC entries are registered anew, and the placeholders a `DeferredTOCRegistry` returned for them
+    are replaced in the HTML recorded after them.
+    """
+    _replay(iter(ops), {})
+
+
+_deferred_token = re.compile("\ue000stx-toc-\\d+-\\w+\ue001")
+
+
+def _replay(ops: Iterator[Op], placeholders: Dict[str, str]):
+    from .buffer import emit_html
+    from .stylesheet import emit_css, define_style_class
+    from .container import open_container
+    from .toc import register_toc_entry, deferred_toc_token
+    from .previews import note_link
+
+    for op in ops:
+        kind = op[0]
+        if kind == "html":
+            html = op[1]
+            if "\ue000" in html:
+                html = _deferred_token.sub(lambda m: placeholders.get(m.group(0), ""), html)
+            emit_html(html)
+        elif kind == "css":
+            emit_css(op[1])
+        elif kind == "class":
+            define_style_class(op[1])
+        elif kind == "link":
+            note_link(op[1])
+        elif kind == "toc":
+            index = len(placeholders) // 2
+            anchor, number = register_toc_entry(op[1], op[2])
+            placeholders[deferred_toc_token(index, "anchor")] = anchor
+            placeholders[deferred_toc_token(index, "number")] = number
+        elif kind == "enter":
+            # Replays the container's content, up to its matching "exit"
+            with open_container(op[1], op[2]):
+                _replay(ops, placeholders)
+        elif kind == "exit":
+            return
+
+
+def render_cached(key: Hashable, build: Callable[[], None]):
+    """
+    Replays the recorded output of a block if it is cached under `key` and its dependencies are unchanged.
+    Otherwise, runs `build` while recording its output, and caches it if it can be replayed.
+    """
+    entry = render_cache.get(key)
+    if entry is not None and entry.is_fresh():
+        replay(entry.ops)
+        return
+
+    recorder = Recorder()
+    token = _active_recorder.set(recorder)
+    try:
+        recorder.start()
+        build()
+        recorder.stop()
+    finally:
+        _active_recorder.reset(token)
+
+    if recorder.valid:
+        dependencies = {path: _file_stamp(path) for path in recorder.dependencies}
+        render_cache.put(key, RenderEntry(recorder.ops, dependencies))
+    else:
+        render_cache.discard(key)
@@ -0,0 +1,51 @@
+from dataclasses import dataclass
+from contextvars import ContextVar
+from typing import Optional, Tuple
+
+
+@dataclass
+class BookConfig:
+    """
+    Class representing rendering options for a StreamTeX book.
+    """
+
+    buffered_html: bool = True
+    '''A boolean dictating whether consecutive st_* outputs of a block are coalesced into a single st.html element.'''
+    shared_stylesheet: bool = True
+    '''A boolean dictating whether the CSS of all containers is collected into a single, deduplicated <style> element.'''
+    atomic_classes: bool = False
+    '''A boolean dictating whether st_* outputs reference their styles through shared classes of that stylesheet instead of inline style attributes.'''
+    fragment_blocks: bool = False
+    '''A boolean dictating whether each block is run as a Streamlit fragment, so that interacting with its widgets only reruns that block.'''
+    lazy_blocks: Optional[int] = None
+    '''The number of blocks rendered at first and added by each "Load more", as the reader scrolls. `None` renders every block at once.'''
+    render_cache: bool = False
+    '''A boolean dictating whether the output of blocks is recorded and replayed on reruns instead of running their build() again. A block opts out by defining `render_cache = False`.'''
+    link_previews: bool = True
+    '''A boolean dictating whether the title and icon of the pages of external links are fetched in the background, for their hover card.'''
+    inline_image_size: Optional[int] = 8192
+    '''The size in bytes up to which local images given by path are embedded in the page as data URIs. Larger ones are published to static/stx-assets and referenced by URL. `None` embeds them all.'''
+    max_inline_image_size: Optional[int] = None
+    '''The size in bytes above which local images are never embedded as data URIs, e.g. in a static export (their source is left empty). `None` embeds images of any size.'''
+    responsive_images: bool = True
+    '''A boolean dictating whether images served from the static files are offered to browsers in downscaled copies (srcset) too, generated with Pillow if it is installed.'''
+    image_formats: Tuple[str, ...] = ()
+    '''The modern formats ("avif", "webp") images served from the static files are converted to with Pillow, offered to browsers in that order of preference, before the original.'''
+    image_quality: int = 75
+    '''The quality (1-100) of the images converted to `image_formats`.'''
+    lazy_images: bool = False
+    '''A boolean dictating whether st_image lets browsers load images as they come into view, giving them their dimensions and a blurred placeholder (read with Pillow, if it is installed) so that the page doesn't move as they load.'''
+
+
+_book_config: ContextVar[BookConfig] = ContextVar("book_config", default=BookConfig())
+'''The configuration of the book currently being rendered.'''
+
+
+def set_book_config(config: BookConfig = None):
+    """Sets the configuration used by the current run. `None` restores the defaults."""
+    _book_config.set(config if config is not None else BookConfig())
+
+
+def get_book_config() -> BookConfig:
+    """Returns the configuration used by the current run."""
+    return _book_config.get()
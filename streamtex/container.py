@@ -1,95 +1,79 @@
-import streamlit as st
 from contextlib import contextmanager
-import uuid
 from .styles import Style, StreamTeX_Styles
 from .enums import Tag, Tags
 from .utils import generate_key
-from typing import Literal
+from .buffer import html_flow, HtmlFlow
+from .stylesheet import emit_css, CSSRule
+from .cache import active_recorder
+from .backend import backend
+from typing import List, Literal
+
+
+def container_selector(key: str) -> str:
+    """Returns the CSS selector of the Streamlit container created with the given key."""
+    # Streamlit adds the class `st-key-{key}` to keyed containers.
+    # The second class keeps our rules above Streamlit's own single-class styles of the block.
+    return f".stVerticalBlock.st-key-{key}"
+
+
+@contextmanager
+def open_container(key: str = None, flow: HtmlFlow = "column"):
+    """A Context Manager creating a native Streamlit container, recorded for the block render cache."""
+    recorder = active_recorder()
+    if recorder is not None:
+        recorder.check()
+        recorder.ops.append(("enter", key, flow))
+
+    with backend().container(key=key), html_flow(flow):
+        if recorder is not None:
+            recorder.enter()
+        yield
+        if recorder is not None:
+            recorder.leave()
+            recorder.ops.append(("exit",))
+
+
+@contextmanager
+def keyed_container(key: str, rules: List[CSSRule], flow: HtmlFlow = "column"):
+    """
+    A Context Manager creating a native Streamlit container with the given key,
+    after adding the CSS rules which target it through `container_selector(key)`.
+    """
+    emit_css(rules)
+    with open_container(key, flow):
+        yield
+
 
 @contextmanager
 def st_block(style: Style = StreamTeX_Styles.none):
     """A Context Manager that wraps content within a styled container."""
-    
-    # 1. Generate a unique ID to scope the CSS to this specific block
-    block_id = generate_key("block")
-    
-    # 2. Inject CSS that targets the container immediately following this style block
-    # We use the :has() selector or adjacent sibling combinators to target the container
-    css = f"""
-    <style>
-        {f'''
-        div:has(> .stVerticalBlock > .element-container > .stHtml > span.{block_id}) {{
-            height: 100%;
-            flex-direction: row;
-
-        }}
-        ''' if False else ""}
-        
-        /* Target the specific container wrapper */
-        div:has(> .element-container > .stHtml > span.{block_id}) {{
-            {str(style)}
-        }}
-        
-        .element-container:has(.stHtml > span.{block_id}) {{
-            width: auto;
-        }}
-    </style>
-    """
-    
-    # 3. Render the styles
-    st.html(css)
-    
-    # 4. Create a native Streamlit container
-    with st.container():
-        # Insert a marker div so our CSS knows which container to target
-        st.html(f'<span class="{block_id}" style="display:none;"></span>')
+
+    # 1. Generate a unique key to scope the CSS to this specific block
+    block_id = generate_key("block", style)
+    block = container_selector(block_id)
+
+    # 2. Create a native Streamlit container, styled through its key
+    with keyed_container(block_id, [(block, str(style))]):
         yield
-        
-        
+
+
 @contextmanager
 def st_span(style: Style = StreamTeX_Styles.none):
     """
     A Context Manager that wraps content within a styled container.
     Its contents are inserted in the same line.
     """
-    
-    # 1. Generate a unique ID to scope the CSS to this specific block
-    block_id = generate_key("span")
-    
-    # 2. Inject CSS that targets the container immediately following this style block
-    # We use the :has() selector or adjacent sibling combinators to target the container
-    css = f"""
-    <style>
-        div:has(> .element-container > .stHtml > span.{block_id}) > * {{
-            /* make elements only occupy the width they need */
-            width: auto;
-        }}
-        
-        /* Target the specific container wrapper */
-        div:has(> .element-container > .stHtml > span.{block_id}) {{
-            /* make elements stay in same line*/
-            display: flex; flex-direction: row;
-            
-            /* allow for whitespace to show*/
-            white-space: pre;
-            
-            {str(style)}
-        }}
-        
-        .element-container:has(.stHtml > span.{block_id}) {{
-            width: auto;
-        }}
-    </style>
-    """
-    
-    # 3. Render the styles
-    st.html(css)
-    
-    # 4. Create a native Streamlit container
-    with st.container():
-        # Insert a marker div so our CSS knows which container to target
-        st.html(f'<span class="{block_id}" style="display:none;"></span>')
+
+    # 1. Generate a unique key to scope the CSS to this specific block
+    block_id = generate_key("span", style)
+    block = container_selector(block_id)
+
+    # 2. Create a native Streamlit container, styled through its key
+    with keyed_container(block_id, [
+        # make elements only occupy the width they need
+        (f"{block} > *", "width: auto;"),
+
+        # make elements stay in same line, and allow for whitespace to show
+        (block, f"display: flex; flex-direction: row; white-space: pre; {style}"),
+    ], flow="row"):
         yield
-        
-        
-        
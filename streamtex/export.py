@@ -0,0 +1,174 @@
+"""
+Renders a StreamTeX book to a single, self-contained HTML file, which any static file server can serve.
+
+Usage:
+    python -m streamtex.export path/to/book.py -o book.html [--jobs N]
+"""
+import os
+import sys
+import time
+import runpy
+import argparse
+import importlib.resources as resources
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+from .backend import HtmlDocument, set_active_document
+from .cache import Recorder, Op, _active_recorder
+from .config import set_book_config
+from .toc import deferred_toc
+from .utils import key_scope, reset_key_scope
+
+
+def render_book(book_path: str, title: str = None, jobs: int = 1) -> str:
+    """
+    Runs a book script (the `book.py` of a project) with the st_* functions writing to an HTML document,
+    and returns that document.
+
+    With more than one job, the blocks are rendered in parallel by worker processes, then stitched
+    together in order, numbering the ToC as they are.
+    """
+    book_path = os.path.abspath(book_path)
+    book_dir = os.path.dirname(book_path)
+    document = HtmlDocument(title or os.path.basename(book_dir))
+
+    with _book_folder(book_dir):
+        if _theme_base() == "dark":
+            document.body_classes.append("stx-dark")
+        document.head.append(f"<style>{resources.files('streamtex.static').joinpath('export.css').read_text()}</style>")
+
+        if jobs <= 1:
+            set_active_document(document)
+            try:
+                runpy.run_path(book_path, run_name="__main__")
+            finally:
+                set_active_document(None)
+            return document.render()
+
+        # 1. Run the book script up to st_book, to get its blocks
+        module_list, toc_config, args, book_config, kwargs = _capture_book(book_path)
+
+        # 2. Render the blocks in parallel
+        start = time.perf_counter()
+        timings = []
+        with ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=(book_path,)) as pool:
+            for index, ops, seconds in pool.map(_render_block, range(len(module_list))):
+                document.rendered_blocks[index] = ops
+                timings.append((seconds, module_list[index].__name__))
+        elapsed = time.perf_counter() - start
+        _print_timings(timings, elapsed, jobs)
+
+        # 3. Stitch them together
+        from . import st_book
+        set_active_document(document)
+        try:
+            st_book(module_list, toc_config, *args, book_config=book_config, **kwargs)
+        finally:
+            set_active_document(None)
+
+    return document.render()
+
+
+class _book_folder:
+    """A Context Manager running code as `streamlit run` runs a book: from its project folder."""
+    def __init__(self, book_dir: str):
+        self.book_dir = book_dir
+
+    def __enter__(self):
+        self.previous_dir = os.getcwd()
+        sys.path.insert(0, self.book_dir)
+        os.chdir(self.book_dir)
+
+    def __exit__(self, *exc):
+        os.chdir(self.previous_dir)
+        sys.path.remove(self.book_dir)
+        return False
+
+
+def _capture_book(book_path: str) -> tuple:
+    """Runs a book script, stopping at st_book, and returns the arguments st_book was called with."""
+    capture = HtmlDocument(capture_only=True)
+    set_active_document(capture)
+    try:
+        runpy.run_path(book_path, run_name="__main__")
+    finally:
+        set_active_document(None)
+
+    if capture.book is None:
+        raise RuntimeError(f"{book_path} doesn't call st_book()")
+    return capture.book
+
+
+_worker_book: tuple = None
+'''The arguments of st_book in the book script of a worker process.'''
+
+
+def _init_worker(book_path: str):
+    global _worker_book
+    book_dir = os.path.dirname(book_path)
+    sys.path.insert(0, book_dir)
+    os.chdir(book_dir)
+    _worker_book = _capture_book(book_path)
+
+
+def _render_block(index: int) -> Tuple[int, List[Op], float]:
+    """Renders a block of the worker's book, returning its recorded output and how long it took."""
+    from . import st_include
+    module_list, toc_config, args, book_config, kwargs = _worker_book
+    module = module_list[index]
+    start = time.perf_counter()
+
+    # The block's keys are numbered as in the whole book: after the earlier occurrences of the same block
+    set_book_config(book_config)
+    reset_key_scope()
+    for earlier in module_list[:index]:
+        if earlier is module:
+            with key_scope(module.__name__):
+                pass
+
+    recorder = Recorder()
+    token = _active_recorder.set(recorder)
+    set_active_document(HtmlDocument())
+    try:
+        with deferred_toc(toc_config):
+            st_include(module, *args, **kwargs)
+    finally:
+        set_active_document(None)
+        _active_recorder.reset(token)
+
+    return index, recorder.ops, time.perf_counter() - start
+
+
+def _print_timings(timings: List[Tuple[float, str]], elapsed: float, jobs: int):
+    total = sum(seconds for seconds, _ in timings)
+    print(f"Rendered {len(timings)} blocks in {elapsed:.2f}s with {jobs} processes "
+          f"({total:.2f}s of block time, {total / elapsed if elapsed else 0:.1f}x).")
+    for seconds, name in sorted(timings, reverse=True)[:10]:
+        print(f"  {seconds:8.3f}s  {name}")
+
+
+def _theme_base() -> str:
+    """Returns the base theme ("light" or "dark") configured in the project's .streamlit/config.toml."""
+    from streamlit import config
+    config.get_config_options(force_reparse=True)
+    return config.get_option("theme.base") or "light"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m streamtex.export", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("book", help="the book script of a project, e.g. project/book.py")
+    parser.add_argument("-o", "--output", help="the HTML file to write (default: the book's name, next to it)")
+    parser.add_argument("--title", help="the title of the page (default: the project's folder name)")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="the number of processes rendering blocks in parallel (0: one per CPU)")
+    args = parser.parse_args(argv)
+
+    output = args.output or os.path.splitext(args.book)[0] + ".html"
+    page = render_book(args.book, args.title, args.jobs or os.cpu_count())
+    with open(output, "w", encoding="utf-8") as f:
+        f.write(page)
+    print(f"Wrote {output} ({len(page) / 1024:.0f} KiB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,58 +1,104 @@
-import streamlit as st
-import uuid
-from typing import List, Union
+import re
+from typing import List, Optional, Union
 from contextlib import contextmanager
 from .styles import Style, StyleGrid, StreamTeX_Styles
-from .container import st_block
+from .container import st_block, keyed_container, container_selector
 from .utils import generate_key
 
 # Helper type definition
 CELL_STYLES_TYPE = Union[List[List[Style]], List[Style], Style, StyleGrid]
 
+
+def count_grid_columns(template: str) -> Optional[int]:
+    """
+    Returns the number of columns of a CSS grid-template-columns value, e.g. 3 for "auto repeat(2, 1fr)".
+    Returns None if it depends on the width of the grid (auto-fill, auto-fit).
+    """
+    count = 0
+    # Split into top-level tracks, keeping the arguments of functions (repeat, minmax) together
+    for track in re.findall(r"\[[^\]]*\]|[^\s(\[]+(?:\((?:[^()]|\([^()]*\))*\))?", template):
+        if track.startswith("["):
+            # Line names aren't tracks
+            continue
+        repeat = re.match(r"repeat\(\s*([^,]+),(.*)\)$", track)
+        if repeat is None:
+            count += 1
+        elif repeat.group(1).strip().isdigit():
+            count += int(repeat.group(1)) * (count_grid_columns(repeat.group(2)) or 1)
+        else:
+            return None
+    return count or None
+
 class GridController:
-    def __init__(self, cols: str | int = 2, cell_styles: CELL_STYLES_TYPE = StreamTeX_Styles.none):
+    def __init__(self, cols: str | int = 2, cell_styles: CELL_STYLES_TYPE = StreamTeX_Styles.none, cycle: bool = False):
         self.cell_styles = cell_styles
         self.cell_counter = 0 # Tracks total cells to map styles to flat list/matrix
-        
-        # Infer column count
+        self.cycle = cycle
+
+        # Infer column count (None if the template doesn't fix it, e.g. with auto-fill)
         if isinstance(cols, int):
             self.cols = cols
         else:
-            self.cols = cols.count(" ")+1
+            self.cols = count_grid_columns(cols)
+
+        # The styles are laid out once, so that each cell looks its style up by index
+        self._style = StreamTeX_Styles.none
+        '''The style of every cell, when a single style is given.'''
+        self._flat: Optional[List[Style]] = None
+        '''The style of each cell, in the order cells are added.'''
+        self._matrix: Optional[List[List[Style]]] = None
+        '''The style of each cell by row and column, when cycling through a matrix.'''
+        self._grid: Optional[StyleGrid] = None
+        '''The StyleGrid the style of each cell is looked up in, by row and column.'''
+
+        if isinstance(cell_styles, StyleGrid) and self.cols and not cycle:
+            # Large grids are mostly made from a few ranges: they aren't expanded into a matrix
+            self._grid = cell_styles
+        elif isinstance(cell_styles, StyleGrid):
+            cell_styles = cell_styles.css_grid
+        if isinstance(cell_styles, Style):
+            self._style = cell_styles
+        elif isinstance(cell_styles, list):
+            is_matrix = all(isinstance(row, list) for row in cell_styles)
+            if not is_matrix:
+                self._flat = cell_styles
+            elif not self.cols:
+                # Without a known number of columns, the matrix is read row after row
+                self._flat = [item for sublist in cell_styles for item in sublist]
+            elif cycle:
+                self._matrix = [row for row in cell_styles if row]
+            else:
+                # Each row of the matrix styles a row of the grid: the cells it doesn't cover get no style
+                none = StreamTeX_Styles.none
+                self._flat = [
+                    row[col] if col < len(row) else none
+                    for row in cell_styles for col in range(self.cols)
+                ]
 
     def _resolve_style(self, idx: int) -> Style:
         """
         Determines the style for the current cell based on the global index.
         """
-        styles = self.cell_styles
-
-        # Case 1: Single Style
-        if isinstance(styles, Style):
-            return styles
-
-        # Case 2: List of Styles (Flat)
-        elif isinstance(styles, list):
-            # Check if it is a Matrix (List of Lists)
-            is_matrix = all(isinstance(row, list) for row in styles)
-            if is_matrix:
-                # Flatten the matrix for simple indexing
-                flat_styles = [item for sublist in styles for item in sublist]
-                if idx < len(flat_styles):
-                    return flat_styles[idx]
-            else:
-                # Flat List
-                if idx < len(styles):
-                    return styles[idx]
-                    
-        # Case 3: StyleGrid (Matrix object)
-        elif isinstance(styles, StyleGrid):
-            # Flatten logic for StyleGrid
-            flat_grid = [item for sublist in styles.css_grid for item in sublist]
-            if idx < len(flat_grid):
-                return flat_grid[idx]
-
-        # Case 4: Fallback
-        return StreamTeX_Styles.none
+        # 1. StyleGrid: the cells outside of it get no style
+        if self._grid is not None:
+            style = self._grid.style_at(idx // self.cols, idx % self.cols)
+            return style if style is not None else StreamTeX_Styles.none
+
+        # 2. Cycling through a matrix: rows and columns repeat independently (e.g. [[none], [grey]] stripes rows)
+        if self._matrix:
+            row = self._matrix[(idx // self.cols) % len(self._matrix)]
+            return row[(idx % self.cols) % len(row)]
+
+        # 3. Styles by cell index
+        if self._flat is not None:
+            if idx < len(self._flat):
+                return self._flat[idx]
+            if self.cycle and self._flat:
+                return self._flat[idx % len(self._flat)]
+            return StreamTeX_Styles.none
+
+        # 4. Single style (or none)
+        return self._style
 
     @contextmanager
     def cell(self):
@@ -77,6 +123,7 @@ def st_grid(
     cols: str | int = 2, 
     grid_style: Style = StreamTeX_Styles.none, 
     cell_styles: CELL_STYLES_TYPE = StreamTeX_Styles.none,
+    cycle: bool = False,
 ):
     """
     A context manager representing a grid layout with customizable styles for the grid and individual cells.
@@ -94,6 +141,9 @@ def st_grid(
         - A matrix (list of lists) of `Style` objects.
         - A flat list of `Style` objects.
         - A single `Style` applied to all cells.
+        Each row of a matrix styles a row of the grid, unless the number of columns isn't fixed (auto-fill).
+    :param cycle: If True, the cell styles repeat for the cells after them, however many there are.
+        The rows and columns of a matrix repeat independently: `[[s.none], [grey_bg]]` stripes the rows.
     
     ## Notes: 
     - Cells are filled from top to bottom, left to right.
@@ -118,7 +168,7 @@ def st_grid(
     """
     
     # 1. Generate ID
-    grid_id = generate_key("css-grid")
+    grid_id = generate_key("css-grid", f"{cols}{grid_style}")
     
     # 2. Convert int cols to str if needed
     template = cols
@@ -126,48 +176,29 @@ def st_grid(
         template = " ".join(["1fr"]*cols)
     
     
-    # 3. Inject CSS
-    # We target the direct parent stVerticalBlock of our marker.
+    # 3. Define CSS rules
+    # We target the Streamlit Container through its key.
     # We essentially turn the Streamlit Container into a CSS Grid Container.
-    css = f"""
-    <style>
-        /* 1. Turn the container into a Grid */
-        div[data-testid="stVerticalBlock"]:has(> .element-container .stHtml span.{grid_id}) {{
-            display: grid;
-            grid-template-columns: {template};
-            gap: 0;
-            align-items: stretch; /* Ensures equal height cells */
-        }}
+    grid = container_selector(grid_id)
+    rules = [
+        # 1. Turn the container into a Grid (align-items: stretch ensures equal height cells)
+        (grid, f"display: grid; grid-template-columns: {template}; gap: 0; align-items: stretch;"),
         
-        /* 2. Hide Non-Cell Elements */
-        /* Streamlit injects script tags and empty divs for st.html(). 
-           We must force them to not take up grid slots. */
-        div[data-testid="stVerticalBlock"]:has(> .element-container .stHtml span.{grid_id}) > .element-container:has(style),
-        div[data-testid="stVerticalBlock"]:has(> .element-container .stHtml span.{grid_id}) > .element-container:has(span.{grid_id}),
-        div[data-testid="stVerticalBlock"]:has(> .element-container .stHtml span.{grid_id}) > .element-container:has(script) {{
-            display: none !important;
-        }}
-
-        /* 3. Ensure Cells (stVerticalBlocks inside the grid) behave */
-        /* The direct children of the grid are the 'cells'. */
-        div[data-testid="stVerticalBlock"]:has(> .element-container .stHtml span.{grid_id}) > .stVerticalBlock {{
-            width: auto !important; /* Override Streamlit's width logic */
-            min-width: 0; /* Prevent grid blowout from large images */
-        }}
+        # 2. Hide Non-Cell Elements
+        # Streamlit may inject empty divs for script tags in st.html().
+        # We must force them to not take up grid slots.
+        (f"{grid} > .element-container:has(script)", "display: none !important;"),
         
-        /* Apply Wrapper Style to the grid container itself if needed, 
-           or we can wrap it. Here we apply to the grid container. */
-        div[data-testid="stVerticalBlock"]:has(> .element-container .stHtml span.{grid_id}) {{
-            {str(grid_style)}
-        }}
-    </style>
-    """
-    st.html(css)
+        # 3. Ensure Cells (stVerticalBlocks inside the grid) behave
+        # The direct children of the grid are the 'cells'.
+        # Override Streamlit's width logic, and prevent grid blowout from large images.
+        (f"{grid} > .stVerticalBlock", "width: auto !important; min-width: 0;"),
+        
+        # Apply Wrapper Style to the grid container itself.
+        (grid, str(grid_style)),
+    ]
     
     # 4. Render
-    with st.container():
-        # Marker
-        st.html(f'<span class="{grid_id}" style="display:none"></span>')
-        
-        controller = GridController(cols, cell_styles)
+    with keyed_container(grid_id, rules):
+        controller = GridController(cols, cell_styles, cycle)
         yield controller
\ No newline at end of file
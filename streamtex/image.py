@@ -1,6 +1,14 @@
 import os
-import streamlit as st
+import re
+from typing import List, Tuple
+from urllib.parse import quote
 from .styles import Style, StreamTeX_Styles
+from .buffer import emit_html
+from .stylesheet import style_attr
+from .cache import LRUCache, record_dependency, _file_stamp
+from .assets import publish_asset, image_size, image_width, image_widths, image_variant, can_transcode, image_placeholder, image_mime_types
+from .config import get_book_config
+from .backend import active_document
 from .utils import __is_url, __is_absolute_path, __is_relative_path, __get_mime_type, __get_base64_encoded_image, contain_link
 
 def st_image(
@@ -47,13 +55,21 @@ def st_image(
     css_style = f"{str(style)} width: {width}; height: {height};"
 
     # 4. Construct the HTML
-    html_content = f'<img src="{img_src}" alt="{alt}" style="{css_style}">'
+    srcset, sources = _image_sources(uri, img_src, width)
+    loading = ""
+    if get_book_config().lazy_images:
+        loading, placeholder_css = _lazy_loading(uri, img_src)
+        css_style += placeholder_css
+    html_content = f'<img src="{img_src}"{srcset}{loading} alt="{alt}"{style_attr(css_style)}>'
+    if sources:
+        # Browsers pick the first format they support, falling back on the img
+        html_content = f"<picture>{sources}{html_content}</picture>"
     
     # 5. Handle Link Wrapping
     html_content = contain_link(html_content, link, False, hover)
 
     # 6. Render
-    st.html(html_content)
+    emit_html(html_content)
 
 def get_image_src(uri: str) -> str:
     """
@@ -64,24 +80,160 @@ def get_image_src(uri: str) -> str:
         # If it's a URL, use it directly
         img_src = uri
     elif __is_absolute_path(uri) or __is_relative_path(uri):
-        # If it's an absolute or relative path, try converting the file to base64
-        file_path = uri if __is_absolute_path(uri) else os.path.join(os.getcwd(), uri)
-        
-        # Check if file exists before trying to read it
-        if os.path.exists(file_path):
-            mime_type = __get_mime_type(file_path)
-            encoded_image = __get_base64_encoded_image(file_path)
-            if mime_type and encoded_image:
-                # Use base64 encoding for local files with correct MIME type
-                img_src = f"data:{mime_type};base64,{encoded_image}"
-            else:
-                img_src = ""  # Unsupported format or encoding failed
-        else:
-            img_src = "" # File not found
+        # If it's an absolute or relative path, publish it to the static files, or embed it if it is small
+        img_src = _local_image_src(_local_path(uri))
+    elif active_document() is not None:
+        # A rendered document has no static file server: its static images are embedded too
+        img_src = _file_data_uri(_local_path(uri))
     else:
         # If no specific relative or absolute indicator, assume it's a static path (Legacy behavior)
         # Note: You might want to update this logic if your static handling changes
-        img_src = f"app/static/images/{uri}"
+        # Encoded like the published files, so that the URL can be listed in a srcset
+        img_src = f"app/static/images/{quote(uri)}"
         
     return img_src
 
+def _local_path(uri: str) -> str:
+    """Returns the path of the file of a local image: an absolute or relative path, or a static image."""
+    if __is_absolute_path(uri):
+        return uri
+    if __is_relative_path(uri):
+        return os.path.join(os.getcwd(), uri)
+    return os.path.join(os.getcwd(), "static", "images", uri)
+
+def _local_image_src(file_path: str) -> str:
+    """
+    Returns the source of a local image: the URL it is published at, or a data URI
+    for small images (see `BookConfig.inline_image_size`) and rendered documents, which have no static file server.
+    """
+    max_inline_size = get_book_config().inline_image_size
+    if active_document() is None and max_inline_size is not None:
+        stamp = _file_stamp(file_path)
+        if stamp is not None and stamp[1] > max_inline_size:
+            record_dependency(file_path)
+            url = publish_asset(file_path)
+            if url is not None:
+                return url
+    return _file_data_uri(file_path)
+
+_PAGE_WIDTH = 1632
+'''The width in CSS pixels of the fixed 1224pt page (see `inject_zoom_logic`), which "Fit" scales to the width of the window.'''
+_CONTENT_WIDTH = 1536
+'''The width in CSS pixels of the content of the page, inside its 36pt paddings.'''
+
+def _display_width(width: str) -> float:
+    """Returns the largest width in CSS pixels of the page an image of the given CSS width is displayed at."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)(px|%)\s*", str(width))
+    if match is None:
+        # e.g. "auto": at most the width of the page
+        return _CONTENT_WIDTH
+    value = float(match.group(1))
+    return value if match.group(2) == "px" else min(value, 100) / 100 * _CONTENT_WIDTH
+
+def _image_sources(uri: str, img_src: str, width: str) -> Tuple[str, str]:
+    """
+    Returns the srcset and sizes attributes offering downscaled copies of a local image, so that browsers
+    download the smallest one covering the size it is displayed at, and the <source> elements offering it
+    in modern formats (see `BookConfig.image_formats`). Returns empty strings if there are none.
+
+    The copies are generated in the background: until they are ready, the image is only offered as it is
+    (`python -m streamtex.prewarm` generates them ahead of time).
+    """
+    # 1. Only the images served from the static files get copies: embedded ones are small, or in a rendered document
+    config = get_book_config()
+    if not (config.responsive_images or config.image_formats) or not img_src.startswith("app/static/"):
+        return "", ""
+    file_path = _local_path(uri)
+    record_dependency(file_path)
+    source_width = image_width(file_path)
+    if source_width is None:
+        return "", ""
+
+    # 2. "Fit" scales the page to the window: the image takes the same share of the window
+    display_width = _display_width(width)
+    widths = image_widths(source_width, display_width) if config.responsive_images else []
+    sizes = f' sizes="{display_width * 100 / _PAGE_WIDTH:.2f}vw"'
+
+    # 3. The copies in the format of the image, the original being the largest
+    candidates = _candidates(file_path, widths)
+    srcset = f' srcset="{", ".join(candidates + [f"{img_src} {source_width}w"])}"{sizes}' if candidates else ""
+
+    # 4. The copies in each modern format, preferred in the given order
+    sources = ""
+    for image_format in config.image_formats:
+        if not can_transcode(file_path, image_format):
+            continue
+        # All the copies are asked for at once, so that they are all generated while the first run goes on
+        full_size = image_variant(file_path, None, image_format, config.image_quality, wait=False)
+        candidates = _candidates(file_path, widths, image_format, config.image_quality)
+        if full_size is not None:
+            candidates.append(f"{full_size} {source_width}w")
+            sources += f'<source type="{image_mime_types[image_format]}" srcset="{", ".join(candidates)}"{sizes}>'
+    return srcset, sources
+
+def _candidates(file_path: str, widths: List[int], image_format: str = None, quality: int = 75) -> List[str]:
+    """Returns the srcset candidates of the downscaled copies of a local image."""
+    candidates = []
+    for variant_width in widths:
+        url = image_variant(file_path, variant_width, image_format, quality, wait=False)
+        if url is not None:
+            candidates.append(f"{url} {variant_width}w")
+    return candidates
+
+def _lazy_loading(uri: str, img_src: str) -> Tuple[str, str]:
+    """
+    Returns the attributes letting browsers load an image when it comes into view, with its dimensions,
+    and the CSS showing a blurred placeholder until it is loaded.
+    """
+    attributes = ' loading="lazy" decoding="async"'
+    if __is_url(uri) or not img_src:
+        return attributes, ""
+
+    # 1. The dimensions give the image its aspect ratio before it is loaded: the page doesn't move as it arrives
+    file_path = _local_path(uri)
+    record_dependency(file_path)
+    size = image_size(file_path)
+    if size is None:
+        return attributes, ""
+    attributes += f' width="{size[0]}" height="{size[1]}"'
+
+    # 2. Embedded images are already there
+    if img_src.startswith("data:"):
+        return attributes, ""
+    placeholder = image_placeholder(file_path)
+    return attributes, f" background: center / cover no-repeat url({placeholder});" if placeholder else ""
+
+image_cache = LRUCache(256, max_size=64 * 1024 * 1024)
+'''The data URIs of local images, keyed by (absolute path, mtime, size), shared by all sessions.'''
+
+
+def _file_data_uri(file_path: str) -> str:
+    """Returns a base64 data URI embedding a local image file, or an empty string if it can't be read."""
+    # 1. The block depends on the image even when it is cached
+    record_dependency(file_path)
+
+    # 2. Check if file exists before trying to read it: a changed file gets a new key
+    path = os.path.abspath(file_path)
+    stamp = _file_stamp(path)
+    if stamp is None:
+        return "" # File not found
+    max_size = get_book_config().max_inline_image_size
+    if max_size is not None and stamp[1] > max_size:
+        print(f"Not embedding {file_path}: it is larger than BookConfig.max_inline_image_size ({max_size} bytes)")
+        return ""
+    key = (path,) + stamp
+    data_uri = image_cache.get(key)
+    if data_uri is not None:
+        return data_uri
+
+    # 3. Encode the file
+    mime_type = __get_mime_type(file_path)
+    if not mime_type:
+        data_uri = "" # Unsupported format
+    else:
+        # Use base64 encoding for local files with correct MIME type
+        data_uri = __get_base64_encoded_image(file_path, f"data:{mime_type};base64,")
+        if not data_uri:
+            return "" # Encoding failed: it may succeed next time
+    image_cache.put(key, data_uri)
+    return data_uri
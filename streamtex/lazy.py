@@ -0,0 +1,143 @@
+import streamlit as st
+from contextlib import contextmanager
+
+from .cache import LRUCache, source_hash
+from .toc import toc_state, toc_calls, register_toc_entry
+
+streamtex_loaded_blocks = "_streamtex_loaded_blocks"
+load_more_key = "stx-load-more"
+
+_block_toc = LRUCache(1024)
+'''The ToC entries registered by each block, keyed by block, source and the ToC numbering it started from.'''
+
+
+def loaded_block_count(total: int, page_size: int) -> int:
+    """
+    Returns how many blocks of the book are rendered in this run.
+
+    A `stx_block` query parameter (e.g. `?stx_block=12`) loads the book up to that block.
+    """
+    count = st.session_state.get(streamtex_loaded_blocks, page_size)
+    target = st.query_params.get("stx_block")
+    if target is not None and target.isdigit():
+        count = max(count, int(target) + 1)
+
+    st.session_state[streamtex_loaded_blocks] = count
+    return min(count, total)
+
+
+def _load_more(page_size: int):
+    st.session_state[streamtex_loaded_blocks] = st.session_state.get(streamtex_loaded_blocks, 0) + page_size
+
+
+def _block_toc_key(block_file_module):
+    return (block_file_module.__name__, source_hash(block_file_module), toc_state())
+
+
+@contextmanager
+def recording_block_toc(block_file_module):
+    """A Context Manager remembering the ToC entries registered inside it by a block."""
+    key = _block_toc_key(block_file_module)
+    first = len(toc_calls()) if key[2] is not None else 0
+    yield
+    if key[2] is not None:
+        _block_toc.put(key, toc_calls()[first:])
+
+
+def register_block_toc(block_file_module) -> bool:
+    """
+    Registers the ToC entries of a block that isn't rendered, as they were when it was last rendered.
+    Returns False if they aren't known.
+    """
+    key = _block_toc_key(block_file_module)
+    if key[2] is None:
+        return True
+
+    entries = _block_toc.get(key)
+    if entries is None:
+        return False
+    for label, level in entries:
+        register_toc_entry(label, level)
+    return True
+
+
+def st_load_more(loaded: int, total: int, page_size: int):
+    """
+    Adds the button loading the next blocks of the book.
+
+    It is clicked automatically when it comes close to the viewport, and when a link
+    targets an anchor which isn't on the page yet, until that anchor is loaded.
+    """
+    with st.container(key=f"{load_more_key}-area"):
+        st.button(f"Load more ({loaded} of {total} blocks shown)", key=load_more_key,
+                  on_click=_load_more, args=(page_size,), width="stretch")
+        # The count tells the script when the button has been clicked already for this run
+        st.html(f'<span class="stx-loaded" data-count="{loaded}"></span>' + _load_more_js,
+                unsafe_allow_javascript=True)
+
+
+_load_more_js = """
+<script>
+(function() {
+    if (window.stxLazyLoading) return;
+    window.stxLazyLoading = true;
+
+    let pending = null;     // Anchor targeted by a link, in a block which isn't loaded yet
+    let requested = null;   // Block count for which the button was clicked
+    let observed = null;    // Button currently watched by the observer
+    let visible = false;    // Whether that button is close to the viewport
+
+    const button = () => document.querySelector('.st-key-stx-load-more button');
+
+    function loadMore() {
+        const marker = document.querySelector('.stx-loaded');
+        const b = button();
+        if (!marker || !b || marker.dataset.count === requested) return;
+        requested = marker.dataset.count;
+        b.click();
+    }
+
+    const visibility = new IntersectionObserver(entries => {
+        visible = entries[entries.length - 1].isIntersecting;
+        if (visible) loadMore();
+    }, {rootMargin: '800px'});
+
+    function update() {
+        const b = button();
+        if (b !== observed) {
+            if (observed) visibility.unobserve(observed);
+            if (b) visibility.observe(b);
+            observed = b;
+            visible = false;
+        }
+        // The loaded blocks may not fill the viewport: keep loading
+        if (b && visible) loadMore();
+        if (pending) {
+            const target = document.getElementById(pending);
+            if (target) {
+                target.scrollIntoView();
+                pending = null;
+            } else if (b) {
+                loadMore();
+            } else {
+                pending = null;
+            }
+        }
+    }
+
+    document.addEventListener('click', e => {
+        const link = e.target.closest('a[href^="#"]');
+        if (!link) return;
+        const id = decodeURIComponent(link.hash.slice(1));
+        if (id && !document.getElementById(id) && button()) {
+            e.preventDefault();
+            pending = id;
+            loadMore();
+        }
+    }, true);
+
+    new MutationObserver(update).observe(document.body, {childList: true, subtree: true});
+    update();
+})();
+</script>
+"""
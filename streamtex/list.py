@@ -1,10 +1,8 @@
-import streamlit as st
-import uuid
 import re
 from contextlib import contextmanager
 from contextvars import ContextVar
 from .styles import Style, StreamTeX_Styles as s, ListStyle
-from .container import st_block
+from .container import keyed_container, open_container, container_selector
 from .enums import ListType, ListTypes
 from .utils import generate_key
 
@@ -26,70 +24,45 @@ class ListController:
         if style:
             final_style = final_style + style
 
-        # We generate a unique ID for the Outer Container (the 'LI')
-        item_id = generate_key("li")
+        # We generate a unique key for the Outer Container (the 'LI')
+        item_id = generate_key("li", final_style)
 
         # CSS Logic
-        css = f"""
-        <style>
-            /* 1. OUTER CONTAINER (Flex Row) */
-            /* This holds the bullet and the content wrapper side-by-side */
-            div[data-testid="stVerticalBlock"]:has(> .element-container .stHtml span.{item_id}) {{
-                display: flex;
-                flex-direction: row;
-                align-items: baseline; /* Aligns bullet with the first line of text */
-                gap: 0.5rem;
-                {f"counter-increment: streamtex-counter;" if self.is_ordered else ""}
-            }}
+        item = container_selector(item_id)
+        rules = [
+            # 0. The item's own style. The layout rules below take precedence over it.
+            (item, str(final_style)),
             
-            /* 2. THE BULLET (::before on Outer) */
-            div[data-testid="stVerticalBlock"]:has(> .element-container .stHtml span.{item_id})::before {{
-                content: {self.bullet_content};
-                flex-shrink: 0;
-                text-align: right;
-                min-width: 1.2rem;
-                color: inherit;
-                font-weight: inherit;
-                
-                /* Alignment tweak: prevents bullet from jumping if baseline is weird */
-                align-self: baseline; 
-            }}
+            # 1. OUTER CONTAINER (Flex Row)
+            # This holds the bullet and the content wrapper side-by-side.
+            # Bullets are aligned with the first line of text.
+            (item, "display: flex; flex-direction: row; align-items: baseline; gap: 0.5rem;"
+                   + (" counter-increment: streamtex-counter;" if self.is_ordered else "")),
             
-            /* 3. HIDE THE MARKER CONTAINER */
-            /* We hide the technical div that holds our span.{item_id} so it doesn't take up space in the flex row */
-            div[data-testid="stVerticalBlock"]:has(> .element-container .stHtml span.{item_id}) > .element-container:has(span.{item_id}) {{
-                display: none;
-            }}
-
-            /* 4. INNER CONTENT WRAPPER */
-            /* The 'st.container()' we yield creates a new stVerticalBlock inside our Outer one.
-               We want this wrapper to grow and handle the vertical stacking of its children. */
-            div[data-testid="stVerticalBlock"]:has(> .element-container .stHtml span.{item_id}) > .stVerticalBlock {{
-                flex-grow: 1;
-                width: auto;      /* Let it fill the flex space */
-                display: flex;
-                flex-direction: column; /* Force children to stack vertically */
-                gap: 0;           /* Optional: tighter stacking */
-                min-width: 0;     /* CSS Grid/Flex trick to prevent overflow issues */
-            }}
-        </style>
-        """
-        st.html(css)
+            # 2. THE BULLET (::before on Outer)
+            # The baseline alignment prevents the bullet from jumping if the baseline is weird.
+            (f"{item}::before", f"content: {self.bullet_content}; flex-shrink: 0; text-align: right; "
+                                "min-width: 1.2rem; color: inherit; font-weight: inherit; align-self: baseline;"),
+            
+            # 3. INNER CONTENT WRAPPER
+            # The 'st.container()' we yield creates a new stVerticalBlock inside our Outer one.
+            # We want this wrapper to grow (filling the flex space) and to stack its children vertically,
+            # with min-width: 0 preventing overflow issues.
+            (f"{item} > .stVerticalBlock", "flex-grow: 1; width: auto; display: flex; "
+                                           "flex-direction: column; gap: 0; min-width: 0;"),
+        ]
 
         # Structure:
-        # [ st_block (Outer) ]
+        # [ keyed container (Outer) ]
         #    -> ::before (Bullet)
         #    -> [ st.container (Inner) ]
         #          -> User Content (Stacked)
         
-        with st_block(style=final_style):
-            st.html(f'<span class="{item_id}" style="display:none"></span>')
-            
-            # THIS IS THE FIX:
+        with keyed_container(item_id, rules):
             # We open a new container to wrap all user content.
             # This container becomes the second item in the Flex Row,
             # and it naturally stacks its children (st_write, st_list) vertically.
-            with st.container():
+            with open_container():
                 yield
 
 
@@ -149,21 +122,16 @@ def st_list(
             if next_level == 2: bullet_content = "'○'"
             elif next_level >= 3: bullet_content = "'■'"
 
-        list_id = generate_key("ul")
+        list_id = generate_key("ul", f"{bullet_content}{l_style}")
         
-        css = f"""
-        <style>
-            div[data-testid="stVerticalBlock"]:has(> .element-container .stHtml span.{list_id}) {{
-                counter-reset: streamtex-counter;
-                gap: 0.2rem;
-                width: 100%;
-            }}
-        </style>
-        """
-        st.html(css)
+        ul = container_selector(list_id)
+        rules = [
+            # The list's own style, over which the list layout takes precedence
+            (ul, str(l_style)),
+            (ul, "counter-reset: streamtex-counter; gap: 0.2rem; width: 100%;"),
+        ]
 
-        with st_block(style=l_style):
-            st.html(f'<span class="{list_id}" style="display:none"></span>')
+        with keyed_container(list_id, rules):
             yield ListController(li_style=li_style, bullet_content=bullet_content, is_ordered=is_ordered)
             
     finally:
@@ -0,0 +1,344 @@
+import os
+import re
+import json
+import time
+import codecs
+import sqlite3
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from html.parser import HTMLParser
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit, urlunsplit
+
+from .backend import backend
+from .cache import LRUCache, record
+
+Preview = Tuple[str, Optional[str], bool]
+'''The (title, favicon URL, fetched) of the page of a link, as returned by `utils.__get_page_preview`.'''
+
+
+def normalize_url(url: str) -> str:
+    """
+    Returns the form of a URL previews are stored under: the same page has the same form,
+    whatever the case of its host, its default port or its fragment.
+    """
+    parts = urlsplit(url.strip() if "://" in url else "http://" + url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and (scheme, parts.port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{parts.port}"
+    return urlunsplit((scheme, host, parts.path or "/", parts.query, ""))
+
+
+class PreviewStore:
+    """
+    The previews of links, stored in a SQLite file by normalized URL, shared by the sessions and the processes using it.
+
+    Previews expire after `ttl` seconds, so that each page is fetched at most once per `ttl`.
+    Pages which couldn't be fetched are remembered too, for `failure_ttl` seconds.
+    """
+    def __init__(self, path: str, ttl: float = 7 * 24 * 3600, failure_ttl: float = 3600):
+        self.path = path
+        self.ttl = ttl
+        '''The number of seconds previews are kept.'''
+        self.failure_ttl = failure_ttl
+        '''The number of seconds failures to fetch a page are kept.'''
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        # SQLite connections can't be shared by threads: each thread of the server opens its own
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            # Readers don't wait for the process writing
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS previews "
+                "(url TEXT PRIMARY KEY, title TEXT, favicon TEXT, fetched INTEGER, expires REAL)"
+            )
+            connection.execute("DELETE FROM previews WHERE expires <= ?", (time.time(),))
+            self._local.connection = connection
+        return connection
+
+    def get(self, url: str) -> Optional[Preview]:
+        """Returns the stored preview of a link, or None if there is none or it has expired."""
+        try:
+            row = self._connection().execute(
+                "SELECT title, favicon, fetched FROM previews WHERE url = ? AND expires > ?",
+                (normalize_url(url), time.time()),
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Error reading the link previews of {self.path}: {e}")
+            return None
+        return (row[0], row[1], bool(row[2])) if row is not None else None
+
+    def get_many(self, urls: Iterable[str]) -> Dict[str, Preview]:
+        """Returns the stored previews of links, by link, in a single query. The links without one are left out."""
+        keys: Dict[str, List[str]] = {}
+        for url in urls:
+            keys.setdefault(normalize_url(url), []).append(url)
+        found = {}
+        key_list = list(keys)
+        try:
+            # SQLite limits the number of parameters of a query
+            for start in range(0, len(key_list), 500):
+                batch = key_list[start:start + 500]
+                rows = self._connection().execute(
+                    f"SELECT url, title, favicon, fetched FROM previews "
+                    f"WHERE url IN ({', '.join('?' * len(batch))}) AND expires > ?",
+                    (*batch, time.time()),
+                ).fetchall()
+                for key, title, favicon, fetched in rows:
+                    for url in keys[key]:
+                        found[url] = (title, favicon, bool(fetched))
+        except sqlite3.Error as e:
+            print(f"Error reading the link previews of {self.path}: {e}")
+        return found
+
+    def put(self, url: str, preview: Preview):
+        """Stores the preview of a link, until it expires."""
+        title, favicon, fetched = preview
+        expires = time.time() + (self.ttl if fetched else self.failure_ttl)
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO previews VALUES (?, ?, ?, ?, ?)",
+                (normalize_url(url), title, favicon, int(fetched), expires),
+            )
+        except sqlite3.Error as e:
+            print(f"Error writing the link previews of {self.path}: {e}")
+
+    def clear(self):
+        """Forgets every stored preview."""
+        self._connection().execute("DELETE FROM previews")
+
+
+def _default_path() -> str:
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_dir, "streamtex", "previews.sqlite3")
+
+
+preview_store = PreviewStore(os.environ.get("STREAMTEX_PREVIEW_STORE") or _default_path())
+'''The store of link previews used by StreamTeX. It may be replaced, e.g. by one in a temporary file for tests.'''
+
+
+max_head_size = 256 * 1024
+'''The number of bytes of a page read at most to find its title and icon, if its </head> comes later.'''
+
+max_drain_size = 256 * 1024
+'''The number of bytes read at most after the <head> of a page, so that its connection can be reused for the
+next page of the host. The connection of a longer page is closed instead.'''
+
+
+class _HeadParser(HTMLParser):
+    """Collects the title and the icon of a page, up to the end of its <head>."""
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title: Optional[str] = None
+        self.icon: Optional[str] = None
+        self.done = False
+        '''True once the end of the <head> is reached.'''
+        self._title: Optional[List[str]] = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "title" and self.title is None:
+            self._title = []
+        elif tag == "link" and self.icon is None and "icon" in (attrs.get("rel") or "").lower() and attrs.get("href"):
+            self.icon = attrs["href"]
+        elif tag == "body":
+            self.done = True
+
+    def handle_endtag(self, tag):
+        if tag == "title" and self._title is not None:
+            self.title = "".join(self._title)
+            self._title = None
+        elif tag == "head":
+            self.done = True
+
+    def handle_data(self, data):
+        if self._title is not None:
+            self._title.append(data)
+
+
+def _charset(response, head: bytes) -> str:
+    """Returns the encoding of a page: from its Content-Type, or else a <meta> of its first bytes, or else UTF-8."""
+    match = re.search(r"charset=[\"']?([\w.:-]+)", response.headers.get("content-type", ""), re.IGNORECASE)
+    match = match or re.search(rb"<meta[^>]+charset=[\"']?([\w.:-]+)", head, re.IGNORECASE)
+    charset = match.group(1) if match else "utf-8"
+    charset = charset.decode("ascii") if isinstance(charset, bytes) else charset
+    try:
+        return codecs.lookup(charset).name
+    except LookupError:
+        return "utf-8"
+
+
+def fetch_preview(url: str, session=None, timeout: float = 5, deadline: float = None) -> Optional[Preview]:
+    """
+    Fetches the page title and favicon URL for the given link, reading long pages only up to the end of their <head>.
+
+    If the connection is refused or times out, returns the URL and a default favicon, and for other errors,
+    'Could not fetch page' and None, preventing display of any preview. If `deadline`, a `time.monotonic()` value,
+    passes first, returns None: the page wasn't found to fail, it may be fetched again later.
+    """
+    # requests takes longer to import than the rest of StreamTeX: only load it for previews
+    import requests
+    from requests.exceptions import ConnectionError, Timeout
+
+    default_favicon = 'https://www.google.com/s2/favicons?domain_url=' + url
+    try:
+        get = session.get if session is not None else requests.get
+        with get(url, timeout=timeout, stream=True) as response:
+            response.raise_for_status()
+
+            # The page is parsed as it arrives, and the connection closed after its <head>
+            parser = _HeadParser()
+            decoder = None
+            size = 0
+            chunks = response.iter_content(8192)
+            for chunk in chunks:
+                if decoder is None:
+                    decoder = codecs.getincrementaldecoder(_charset(response, chunk))(errors="replace")
+                parser.feed(decoder.decode(chunk))
+                size += len(chunk)
+                if parser.done or size >= max_head_size:
+                    break
+                if deadline is not None and time.monotonic() > deadline:
+                    raise Timeout(f"{url} took too long")
+            page_url = response.url
+
+            # A connection is only reused once the whole page is read: the rest of a short page is read too
+            length = response.headers.get("content-length", "")
+            if not length.isdigit() or int(length) - response.raw.tell() <= max_drain_size:
+                drained = 0
+                try:
+                    for chunk in chunks:
+                        drained += len(chunk)
+                        if drained > max_drain_size or (deadline is not None and time.monotonic() > deadline):
+                            break
+                except (ConnectionError, Timeout):
+                    # The preview is already there: the connection is only closed
+                    pass
+
+        title = parser.title.strip() if parser.title is not None else 'No title found'
+        favicon = urljoin(page_url, parser.icon) if parser.icon else default_favicon
+        return title, favicon, True
+
+    except (ConnectionError, Timeout):
+        # The timeout is shortened to what is left before the deadline: it may be the deadline which ran out
+        if deadline is not None and time.monotonic() >= deadline:
+            return None
+        # Specifically handle connection refusal or timeout
+        return url, default_favicon, False
+
+    except Exception:
+        return 'Could not fetch page', None, False
+
+
+class PreviewPrefetcher:
+    """
+    Fetches the previews of links in background threads, storing them in `preview_store`: nothing waits for them.
+
+    The links of a host are fetched one after the other through a single session, which reuses its connection,
+    and at most `max_workers` hosts at once. Links still waiting after `deadline` seconds are left for a later batch.
+    """
+    def __init__(self, max_workers: int = 8, deadline: float = 30):
+        self.max_workers = max_workers
+        self.deadline = deadline
+        self._pending = set()
+        '''The normalized URLs being fetched or waiting to be.'''
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def prefetch(self, urls: Iterable[str]):
+        """Starts fetching the previews of the links which aren't stored yet, and returns at once."""
+        urls = list(dict.fromkeys(urls))
+        stored = preview_store.get_many(urls)
+        missing = [url for url in urls if url not in stored]
+        if not missing:
+            return
+
+        deadline = time.monotonic() + self.deadline
+        by_host: Dict[str, List[str]] = {}
+        with self._lock:
+            for url in missing:
+                key = normalize_url(url)
+                if key not in self._pending:
+                    self._pending.add(key)
+                    by_host.setdefault(urlsplit(key).netloc, []).append(url)
+            if by_host and self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="stx-previews")
+        for urls_of_host in by_host.values():
+            self._executor.submit(self._fetch_host, urls_of_host, deadline)
+
+    def _fetch_host(self, urls: List[str], deadline: float):
+        import requests
+        with requests.Session() as session:
+            for url in urls:
+                try:
+                    remaining = deadline - time.monotonic()
+                    preview = fetch_preview(url, session, min(5, remaining), deadline) if remaining > 0 else None
+                    # The links the deadline ran out for aren't stored as failures: a later batch fetches them
+                    if preview is not None:
+                        preview_store.put(url, preview)
+                except Exception as e:
+                    print(f"Error prefetching the preview of {url}: {e}")
+                finally:
+                    with self._lock:
+                        self._pending.discard(normalize_url(url))
+
+
+prefetcher = PreviewPrefetcher()
+'''The prefetcher of the previews of the links of books, shared by all sessions.'''
+
+_links: ContextVar[Optional[Dict[str, None]]] = ContextVar("links", default=None)
+'''The external links written in the current run, in order.'''
+
+_book_links = LRUCache(64)
+'''The external links of each book (by its blocks) when it was last rendered.'''
+
+
+def note_link(url: str):
+    """Notes an external link written to the page, so that its preview is prefetched."""
+    record("link", url)
+    links = _links.get()
+    if links is not None:
+        links[url] = None
+
+
+@contextmanager
+def prefetching_links(module_list):
+    """
+    A Context Manager collecting the external links written inside it, whose previews are then prefetched.
+    The links the book had when it was last rendered are prefetched as soon as it starts.
+    """
+    book_key = tuple(module.__name__ for module in module_list)
+    prefetcher.prefetch(_book_links.get(book_key, ()))
+    links = {}
+    token = _links.set(links)
+    try:
+        yield links
+    finally:
+        _links.reset(token)
+    _book_links.put(book_key, tuple(links))
+    prefetcher.prefetch(links)
+
+
+def add_link_previews(links: Iterable[str]):
+    """
+    Writes the stored previews of links to the page, for the hover card to show.
+    The previews still being fetched are written by a later run.
+    """
+    previews = {
+        url: {"title": preview[0], "favicon": preview[1]}
+        for url, preview in preview_store.get_many(links).items() if preview[2]
+    }
+    if previews:
+        # "</" would end the script early
+        data = json.dumps(previews).replace("</", "<\\/")
+        backend().html(
+            f"<script>window.stxPreviews = Object.assign(window.stxPreviews || {{}}, {data});</script>",
+            unsafe_allow_javascript=True,
+        )
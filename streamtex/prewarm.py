@@ -0,0 +1,88 @@
+"""
+Generates the downscaled and converted copies of the static images of a StreamTeX book ahead of time.
+
+Usage:
+    python -m streamtex.prewarm path/to/book.py [--jobs N]
+"""
+import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+from . import assets
+from .config import BookConfig
+from .export import _book_folder, _capture_book
+
+image_extensions = (".png", ".jpg", ".jpeg", ".gif", ".webp")
+'''The extensions of the files prewarmed.'''
+
+
+def static_images(book_dir: str) -> List[str]:
+    """Returns the paths of the images in the static files of a project, except the published copies."""
+    paths = []
+    static_dir = os.path.join(book_dir, "static")
+    for folder, subfolders, files in os.walk(static_dir):
+        if folder == static_dir and os.path.basename(assets.assets_dir) in subfolders:
+            subfolders.remove(os.path.basename(assets.assets_dir))
+        paths.extend(os.path.join(folder, name) for name in sorted(files) if name.lower().endswith(image_extensions))
+    return sorted(paths)
+
+
+def prewarm_book(book_path: str, jobs: int = 1) -> int:
+    """
+    Generates the copies of the static images of a book that st_image may offer, with the book's configuration,
+    in `jobs` parallel processes. Returns the number of files written.
+
+    The images are prepared for any display size: every downscaled width below theirs is generated.
+    """
+    book_path = os.path.abspath(book_path)
+    book_dir = os.path.dirname(book_path)
+    with _book_folder(book_dir):
+        # 1. Run the book script up to st_book, to get its configuration
+        book_config = _capture_book(book_path)[3] or BookConfig()
+        paths = static_images(book_dir)
+
+        # 2. Convert the images in parallel
+        published = os.path.join(book_dir, assets.assets_dir)
+        before = len(os.listdir(published)) if os.path.isdir(published) else 0
+        start = time.perf_counter()
+        timings = []
+        with ProcessPoolExecutor(jobs, initializer=os.chdir, initargs=(book_dir,)) as pool:
+            for path, seconds in pool.map(_prewarm_image, paths, [book_config] * len(paths)):
+                timings.append((seconds, os.path.relpath(path, book_dir)))
+        elapsed = time.perf_counter() - start
+        written = (len(os.listdir(published)) if os.path.isdir(published) else 0) - before
+
+    print(f"Prewarmed {len(paths)} images in {elapsed:.2f}s with {jobs} processes ({written} files written).")
+    for seconds, name in sorted(timings, reverse=True)[:10]:
+        print(f"  {seconds:8.3f}s  {name}")
+    return written
+
+
+def _prewarm_image(path: str, book_config: BookConfig) -> Tuple[str, float]:
+    """Generates the copies of an image, returning how long it took."""
+    start = time.perf_counter()
+    source_width = assets.image_width(path)
+    if source_width is not None:
+        widths = assets.image_widths(source_width) if book_config.responsive_images else []
+        for width in widths:
+            assets.image_variant(path, width)
+        for image_format in book_config.image_formats:
+            if assets.image_transcode(path, image_format, book_config.image_quality) is not None:
+                for width in widths:
+                    assets.image_variant(path, width, image_format, book_config.image_quality)
+    return path, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m streamtex.prewarm", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("book", help="the book script of a project, e.g. project/book.py")
+    parser.add_argument("-j", "--jobs", type=int, default=0,
+                        help="the number of processes converting images in parallel (default, 0: one per CPU)")
+    args = parser.parse_args(argv)
+    prewarm_book(args.book, args.jobs or os.cpu_count())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
-import streamlit as st
 from typing import Literal
+from .buffer import emit_html
 
 def st_space(direction: Literal["v", "h"] = "v", size="1em") -> str:
     """
@@ -24,7 +24,7 @@ def st_space(direction: Literal["v", "h"] = "v", size="1em") -> str:
         # Horizontal space with padding-left
         space_tag = f"""<span style="padding-left: {size};"></span>"""
     
-    st.html(space_tag)
+    emit_html(space_tag)
 
 def st_br():
    
@@ -1,54 +1,140 @@
-from typing import List, Tuple, Optional, Type, Union
+from typing import Dict, List, Tuple, Optional, Type, Union
+from contextvars import ContextVar
+from weakref import WeakValueDictionary
 import re
+import sys
+import types
 
 
-theme = {}
-'''The theme style dictionary.
-Example: dark = {
-    "red_02" : "color: #660000;",
-    "pink_01": "color: #d6fc00;"   
-}'''
+# `theme` and `themes` are attributes of this module (see `_StylesModule` at the end of the file),
+# scoped to the current run so that sessions running concurrently don't see each other's themes.
+_theme: ContextVar[Optional[dict]] = ContextVar("theme", default=None)
+_themes: ContextVar[Optional[Dict[str, dict]]] = ContextVar("themes", default=None)
+
+Declarations = Dict[str, str]
+'''The declarations of a CSS string, as an ordered property -> value map.
+Text without a colon (malformed) is kept as a key with an empty value.'''
+
+_declaration = re.compile(r"""(?:[^;"'(]|"[^"]*"|'[^']*'|\([^)]*\))+""")
+'''A declaration: anything up to a ";" outside of quotes and parentheses (e.g. `url(data:...;base64,...)`).'''
+
+_parsed: Dict[str, Declarations] = {}
+'''The declarations of each CSS string parsed so far. The maps are shared: never modify them.'''
+_max_parsed = 8192
+
+
+def parse_css(css: str) -> Declarations:
+    '''Returns the declarations of a CSS string, last occurrence of each property winning.'''
+    declarations = _parsed.get(css)
+    if declarations is not None:
+        return declarations
+
+    declarations = {}
+    for chunk in _declaration.findall(css):
+        chunk = chunk.strip()
+        if not chunk:
+            continue
+        name, colon, value = chunk.partition(":")
+        if colon:
+            _set_declaration(declarations, name.strip(), value.strip())
+        else:
+            declarations[chunk] = ""
+    return _remember(css, declarations)
+
+
+def serialize_css(declarations: Declarations) -> str:
+    '''Returns the CSS string of a declarations map.'''
+    return " ".join(f"{name}: {value};" if value else f"{name};" for name, value in declarations.items())
+
+
+def _set_declaration(declarations: Declarations, name: str, value: str):
+    # An !important declaration can only be overridden by another one
+    old = declarations.get(name)
+    if old is not None and old.endswith("!important") and not value.endswith("!important"):
+        return
+    # The property moves to the end, so it still overrides the shorthands/longhands set before it
+    declarations.pop(name, None)
+    declarations[name] = value
+
+
+def _remember(css: str, declarations: Declarations) -> Declarations:
+    # Styles are few: when the memo is full, it is most likely from generated CSS, not worth keeping
+    if len(_parsed) >= _max_parsed:
+        _parsed.clear()
+    _parsed[css] = declarations
+    return declarations
+
+
+def theme_variable(style_id: str, prop: str) -> str:
+    '''Returns the name of the CSS variable holding the value of a property of a switchable style.'''
+    return "--stx-" + re.sub(r"[^\w-]", "_", f"{style_id}-{prop}")
+
+
+_themed: Dict[Tuple[str, str], str] = {}
+'''The CSS of each switchable style, written with its theme variables.'''
+
+
+def themed_css(style_id: str, css: str) -> str:
+    '''
+    Returns the CSS of a style whose properties are read from its theme variables,
+    falling back to its own values when the selected theme doesn't override them.
+    '''
+    result = _themed.get((style_id, css))
+    if result is None:
+        declarations = {}
+        for name, value in parse_css(css).items():
+            if not value:
+                declarations[name] = value
+                continue
+            # The priority stays out of the variable, which only holds a value
+            important = " !important" if value.endswith("!important") else ""
+            value = value[:-len("!important")].strip() if important else value
+            declarations[name] = f"var({theme_variable(style_id, name)}, {value}){important}"
+        result = _themed[(style_id, css)] = serialize_css(declarations)
+    return result
+
+
+def theme_css(theme_dict: dict) -> str:
+    '''
+    Returns the CSS rule defining the theme variables of a theme dictionary.
+    Only the properties the overridden styles define themselves can be switched.
+    '''
+    variables = []
+    for style_id, css in theme_dict.items():
+        for name, value in parse_css(str(css)).items():
+            if value:
+                value = value[:-len("!important")].strip() if value.endswith("!important") else value
+                variables.append(f"{theme_variable(style_id, name)}: {value};")
+    return f":root {{ {' '.join(variables)} }}"
+
 
 def add_css(str1: str, str2: str):
-    '''Concatenates two css strings with a ";" in between.'''
-    if str1 and str2:
-        return str1 + "; " + str2
-    elif str1:
-        return str1
-    else:
+    '''Merges two css strings, the properties of the second one overriding those of the first one.'''
+    if not str1:
         return str2
+    if not str2:
+        return str1
 
-def remove_css(str1: str, str2: str):
-    '''Removes one css string (str2) from another (str1) if present.'''
-    # Split CSS strings into lists of properties
-    props1 = [prop.strip() for prop in str1.split(';') if prop.strip()]
-    props2 = [prop.strip() for prop in str2.split(';') if prop.strip()]
-
-    # Extract property names from props2
-    import re
-    prop_names2 = set()
-    for prop in props2:
-        match = re.match(r'^([^:]+):', prop)
-        if match:
-            prop_name = match.group(1).strip()
-            prop_names2.add(prop_name)
-
-    # Remove properties from props1 that are in prop_names2
-    new_props1 = []
-    for prop in props1:
-        match = re.match(r'^([^:]+):', prop)
-        if match:
-            prop_name = match.group(1).strip()
-            if prop_name not in prop_names2:
-                new_props1.append(prop)
-        else:
-            # Keep properties without a colon (malformed)
-            new_props1.append(prop)
+    declarations = dict(parse_css(str1))
+    for name, value in parse_css(str2).items():
+        _set_declaration(declarations, name, value)
+    css = serialize_css(declarations)
+    _remember(css, declarations)
+    return css
 
-    return '; '.join(new_props1)
+def remove_css(str1: str, str2: str):
+    '''Removes the properties of one css string (str2) from another (str1) if present.'''
+    removed = {name for name, value in parse_css(str2).items() if value}
+    declarations = {name: value for name, value in parse_css(str1).items() if not (value and name in removed)}
+    css = serialize_css(declarations)
+    _remember(css, declarations)
+    return css
 
 class Style:
     """Defines a style, encapsulating a string of (maybe) multiple CSS in-line styles, with a global theme."""
+    # Hundreds of styles are created by the catalog below; __weakref__ allows interning composed styles
+    __slots__ = ("css", "style_id", "__weakref__")
+
     def __init__(self, css: str, style_id: str = ""):
         '''The raw CSS definition'''
         self.css = css      
@@ -62,6 +148,27 @@ class Style:
         return cls(style.css, style_id)
 
     def __add__(self, other):
+        return _compose("+", self, other, self._add)
+
+    def __radd__(self, other):
+        return _compose("r+", self, other, self._radd)
+
+    def __sub__(self, other):
+        return _compose("-", self, other, self._sub)
+
+    def __rsub__(self, other):
+        return _compose("r-", self, other, self._rsub)
+
+    @property
+    def declarations(self) -> Declarations:
+        """The declarations of the (theme-based) CSS of the style. Don't modify the returned map."""
+        return parse_css(str(self))
+
+    def _key(self) -> tuple:
+        """The identity of the style as an operand: its type, resolved CSS and ID."""
+        return (type(self), repr(self), self.style_id)
+
+    def _add(self, other):
         if isinstance(other, Style):
             # Combine the theme-based CSS from each side
             combined_css = add_css(str(self), str(other))
@@ -79,7 +186,7 @@ class Style:
 
         return NotImplemented
 
-    def __radd__(self, other):
+    def _radd(self, other):
         # define reserve addition
         if isinstance(other, str):
             combined_css = add_css(other, str(self))
@@ -88,7 +195,7 @@ class Style:
             return Style(combined_css, new_id)
         return NotImplemented
 
-    def __sub__(self, other):
+    def _sub(self, other):
         if isinstance(other, Style):
             # Remove other's theme-based CSS from self's theme-based CSS
             new_css = remove_css(str(self), str(other))
@@ -103,7 +210,7 @@ class Style:
 
         return NotImplemented
 
-    def __rsub__(self, other):
+    def _rsub(self, other):
         # define reverse subtraction
         if isinstance(other, str):
             new_css = remove_css(other, str(self))
@@ -120,14 +227,21 @@ class Style:
         """
         If a global theme override exists for self.style_id, use that in place of self.css.
         Otherwise, fallback to self.css.
+        Styles overridden by the switchable `themes` read their values from the theme variables.
         """
-        return theme.get(self.style_id, self.css)
+        themes = _themes.get()
+        if themes and self.style_id and any(self.style_id in t for t in themes.values()):
+            return themed_css(self.style_id, self.css)
+        theme = _theme.get()
+        return theme.get(self.style_id, self.css) if theme else self.css
 
 class ListStyle(Style):
     """
     Defines a style for lists, including a style ID for theme lookups
     and custom list symbols for styling levels.
     """
+    __slots__ = ("symbols",)
+
     def __init__(self, css: str = "", style_id: str = "", symbols: List[str] = None):
         super().__init__(css, style_id)
         # Provide a default list of symbols if not specified
@@ -141,7 +255,10 @@ class ListStyle(Style):
         """
         return cls(style.css, style_id, style.symbols)
 
-    def __add__(self, other):
+    def _key(self) -> tuple:
+        return super()._key() + (tuple(self.symbols),)
+
+    def _add(self, other):
         if isinstance(other, Style):
             # Combine theme-based CSS from each
             combined_css = add_css(str(self), str(other))
@@ -163,7 +280,7 @@ class ListStyle(Style):
 
         return NotImplemented
 
-    def __radd__(self, other):
+    def _radd(self, other):
         if isinstance(other, str):
             combined_css = add_css(other, str(self))
             clean_str_id = other.replace(" ", "").replace(";", "")
@@ -172,7 +289,7 @@ class ListStyle(Style):
             return ListStyle(combined_css, new_id, self.symbols)
         return NotImplemented
 
-    def __sub__(self, other):
+    def _sub(self, other):
         if isinstance(other, Style):
             # Remove other's theme-based CSS from self's theme-based CSS
             new_css = remove_css(str(self), str(other))
@@ -195,7 +312,7 @@ class ListStyle(Style):
 
         return NotImplemented
 
-    def __rsub__(self, other):
+    def _rsub(self, other):
         if isinstance(other, str):
             new_css = remove_css(other, str(self))
             clean_str_id = other.replace(" ", "").replace(";", "")
@@ -214,13 +331,112 @@ class ListStyle(Style):
 
 
 
+_compositions: Dict[tuple, "Style"] = {}
+'''The results of `+` and `-` on styles, keyed by the operation and the (resolved) operands.'''
+_max_compositions = 8192
+
+_interned: "WeakValueDictionary[tuple, Style]" = WeakValueDictionary()
+'''The canonical object of each distinct composed style.'''
+
+
+def _compose(op: str, style: "Style", other, compose):
+    """
+    Returns the result of `compose(other)`, memoized.
+
+    Operands are keyed by their resolved CSS rather than their identity, so that results stay
+    correct when the theme changes. Equal results are interned to a single object.
+    """
+    if isinstance(other, Style):
+        key = (op, style._key(), other._key())
+    elif isinstance(other, str):
+        key = (op, style._key(), other)
+    else:
+        return NotImplemented
+
+    result = _compositions.get(key)
+    if result is None:
+        result = compose(other)
+        if result is NotImplemented:
+            return result
+        result = _interned.setdefault(result._key() + (result.css,), result)
+
+        # Styles are few: when the memo is full, it is most likely from generated CSS, not worth keeping
+        if len(_compositions) >= _max_compositions:
+            _compositions.clear()
+        _compositions[key] = result
+    return result
+
+
 class StyleGrid:
     """
     Defines a grid of styles that will be applied to the rows/columns of a table or grid.
+
+    Grids created from cell ranges, and their combinations, only store the ranges and the operations
+    combining them: the style of a cell is worked out when it is needed (`style_at`), and the dense matrix
+    (`css_grid`) is only built if it is asked for.
     """
 
     def __init__(self, css_grid: List[List[Style]] = []):
-        self.css_grid = css_grid
+        self._dense: Optional[List[List[Style]]] = css_grid
+        '''The matrix of styles the grid was created from, if it was created from one.'''
+        self._ranges: List[Tuple[int, int, int, int]] = []
+        '''The (first row, first col, last row, last col) rectangles of cells given `_range_style`.'''
+        self._range_style: Optional[Style] = None
+        self._operands: Optional[tuple] = None
+        '''The (combine_styles, grid, other grid) the grid is the combination of, if it is one.'''
+        self._size: Tuple[int, int] = (0, 0)
+        '''The (rows, cols) of a grid not created from a matrix.'''
+
+    @classmethod
+    def _lazy(cls, size: Tuple[int, int], ranges=(), range_style: Style = None, operands: tuple = None) -> "StyleGrid":
+        grid = cls(None)
+        grid._size = size
+        grid._ranges = list(ranges)
+        grid._range_style = range_style
+        grid._operands = operands
+        return grid
+
+    @property
+    def css_grid(self) -> List[List[Style]]:
+        """The matrix of styles of the grid, built on first access for grids created from ranges."""
+        if self._dense is None:
+            rows, cols = self._size
+            none = StreamTeX_Styles.none
+            self._dense = [[self.style_at(row, col) or none for col in range(cols)] for row in range(rows)]
+        return self._dense
+
+    @css_grid.setter
+    def css_grid(self, css_grid: List[List[Style]]):
+        self._dense = css_grid
+        self._ranges, self._range_style, self._operands = [], None, None
+        self._size = (0, 0)
+
+    def style_at(self, row: int, col: int) -> Optional[Style]:
+        """
+        Returns the style of a cell, or None if the cell is outside of the grid.
+        Cells of the grid which aren't given a style have `StreamTeX_Styles.none`.
+        """
+        if self._dense is not None:
+            if 0 <= row < len(self._dense) and 0 <= col < len(self._dense[row]):
+                return self._dense[row][col]
+            return None
+
+        rows, cols = self._size
+        if not (0 <= row < rows and 0 <= col < cols):
+            return None
+
+        if self._operands is not None:
+            combine_styles, grid, other = self._operands
+            style = grid.style_at(row, col)
+            if style is None:
+                style = StreamTeX_Styles.none
+            other_style = other.style_at(row, col)
+            return combine_styles(style, other_style) if other_style is not None else style
+
+        for first_row, first_col, last_row, last_col in self._ranges:
+            if first_row <= row <= last_row and first_col <= col <= last_col:
+                return self._range_style
+        return StreamTeX_Styles.none
 
     def __add__(self, other):
         """
@@ -284,34 +500,20 @@ class StyleGrid:
     def _combine_with(self, other, combine_styles):
         """
         Combines two StyleGrids using the provided combine_styles function for overlapping cells.
+        The combination is only applied when the styles of its cells are needed.
         """
         self_rows, self_cols = self._get_dimensions()
         other_rows, other_cols = other._get_dimensions()
-
-        max_rows = max(self_rows, other_rows)
-        max_cols = max(self_cols, other_cols)
-
-        # Initialize new grid with Styles.none
-        new_grid = [[StreamTeX_Styles.none for _ in range(max_cols)] for _ in range(max_rows)]
-
-        # Fill in styles from self
-        for i in range(self_rows):
-            for j in range(len(self.css_grid[i])):
-                new_grid[i][j] = self.css_grid[i][j]
-
-        # Combine styles from other
-        for i in range(other_rows):
-            for j in range(len(other.css_grid[i])):
-                if i < max_rows and j < max_cols:
-                    new_grid[i][j] = combine_styles(new_grid[i][j], other.css_grid[i][j])
-
-        return StyleGrid(new_grid)
+        size = (max(self_rows, other_rows), max(self_cols, other_cols))
+        return StyleGrid._lazy(size, operands=(combine_styles, self, other))
 
     def _get_dimensions(self) -> Tuple[int, int]:
-        if not self.css_grid:
+        if self._dense is None:
+            return self._size
+        if not self._dense:
             return 0, 0
-        num_rows = len(self.css_grid)
-        num_cols = max(len(row) for row in self.css_grid) if self.css_grid else 0
+        num_rows = len(self._dense)
+        num_cols = max(len(row) for row in self._dense) if self._dense else 0
         return num_rows, num_cols
 
     @staticmethod
@@ -321,35 +523,27 @@ class StyleGrid:
         Cells are specified in Excel-like notation (e.g., "A1:C3,B5").
         Other cells are filled with Styles.none.
         """
-        # Parse the cells string to get the list of cell indices
-        cells_list = StyleGrid._parse_cells(cells)
+        # Parse the cells string to get the rectangles of cells
+        ranges = StyleGrid._parse_ranges(cells)
 
         # Determine the required grid size
-        max_row_index = max((row for row, _ in cells_list), default=0)
-        max_col_index = max((col for _, col in cells_list), default=0)
+        max_row_index = max((last_row for _, _, last_row, _ in ranges), default=0)
+        max_col_index = max((last_col for _, _, _, last_col in ranges), default=0)
 
         # Adjust grid size based on provided num_rows and num_cols
         grid_rows = max(num_rows if num_rows is not None else 0, max_row_index + 1)
         grid_cols = max(num_cols if num_cols is not None else 0, max_col_index + 1)
 
-        # Initialize the grid with Styles.none
-        grid = [[StreamTeX_Styles.none for _ in range(grid_cols)] for _ in range(grid_rows)]
-
-        # Fill in the specified cells with the given style
-        for row, col in cells_list:
-            if row < grid_rows and col < grid_cols:
-                grid[row][col] = style
-
-        return StyleGrid(grid)
+        return StyleGrid._lazy((grid_rows, grid_cols), ranges, style)
 
     @staticmethod
-    def _parse_cells(cells_str: str) -> List[Tuple[int, int]]:
+    def _parse_ranges(cells_str: str) -> List[Tuple[int, int, int, int]]:
         """
-        Parses a string of cell ranges in Excel-like notation and returns a list of cell indices.
+        Parses a string of cell ranges in Excel-like notation and returns their
+        (first row, first col, last row, last col) indices.
         """
-        cells = []
-        ranges = cells_str.split(',')
-        for cell_range in ranges:
+        ranges = []
+        for cell_range in cells_str.split(','):
             cell_range = cell_range.strip()
             if ':' in cell_range:
                 start_cell, end_cell = cell_range.split(':')
@@ -362,13 +556,11 @@ class StyleGrid:
                 if start_col > end_col:
                     start_col, end_col = end_col, start_col
 
-                for row in range(start_row, end_row + 1):
-                    for col in range(start_col, end_col + 1):
-                        cells.append((row, col))
+                ranges.append((start_row, start_col, end_row, end_col))
             else:
                 row, col = StyleGrid._cell_to_indices(cell_range)
-                cells.append((row, col))
-        return cells
+                ranges.append((row, col, row, col))
+        return ranges
 
     @staticmethod
     def _cell_to_indices(cell: str) -> Tuple[int, int]:
@@ -1319,4 +1511,43 @@ class StreamTeX_Styles:
     """8pt"""
     tiny = text.sizes.tiny_size
     """4pt"""
-        
\ No newline at end of file
+        
+
+
+def _run_dict(var: ContextVar) -> dict:
+    # Each run gets its own dictionary, so that modifying it in place doesn't leak into other sessions
+    value = var.get()
+    if value is None:
+        value = {}
+        var.set(value)
+    return value
+
+
+class _StylesModule(types.ModuleType):
+    @property
+    def theme(self) -> dict:
+        '''The theme style dictionary of the current run, set by `sts.theme = dark`.
+        Example: dark = {
+            "red_02" : "color: #660000;",
+            "pink_01": "color: #d6fc00;"   
+        }'''
+        return _run_dict(_theme)
+
+    @theme.setter
+    def theme(self, value: dict):
+        _theme.set(value)
+
+    @property
+    def themes(self) -> Dict[str, dict]:
+        '''The theme dictionaries the reader can switch between from the sidebar, by name. The first one is selected at first.
+        The styles they override are written with CSS variables (e.g. `color: var(--stx-red_02-color, #990000);`),
+        so switching theme only swaps the small stylesheet defining those variables, without rendering the book again.
+        Example: themes = {"Light": {}, "Dark": dark}'''
+        return _run_dict(_themes)
+
+    @themes.setter
+    def themes(self, value: Dict[str, dict]):
+        _themes.set(value)
+
+
+sys.modules[__name__].__class__ = _StylesModule
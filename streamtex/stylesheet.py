@@ -0,0 +1,223 @@
+import re
+import hashlib
+import streamlit as st
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from .config import get_book_config
+from .cache import LRUCache, record
+from .backend import backend, active_document
+
+streamtex_stylesheet = "_streamtex_stylesheet"
+
+CSSRule = Tuple[str, str]
+'''A (selector, declarations) pair.'''
+
+
+class StyleSheet:
+    """
+    Collects the CSS rules produced while rendering a book and merges the rules sharing the same declarations.
+    """
+    def __init__(self):
+        self.rules: Dict[str, List[str]] = {}
+        '''The selectors of each distinct declaration block, in the order the rules appear in the sheet.'''
+        self.added = 0
+        '''The number of rules added to the sheet.'''
+        self.collapsed = 0
+        '''The number of rules merged into an existing rule with the same declarations.'''
+        self.classes: Dict[str, str] = {}
+        '''The declaration block of each atomic style class defined in the sheet.'''
+        self.unwritten: Optional[List[CSSRule]] = None
+        '''The rules added since they were last written, if the sheet is also written block by block.'''
+
+    def add_rule(self, selector: str, declarations: str):
+        body = _normalize(declarations)
+        if not body:
+            return
+        self.added += 1
+
+        selectors = self.rules.pop(body, None)
+        if selectors is None:
+            selectors = []
+        else:
+            self.collapsed += 1
+        if selector not in selectors:
+            selectors.append(selector)
+        if self.unwritten is not None:
+            self.unwritten.append((selector, body))
+
+        # The merged rule moves to the position of its latest occurrence, so it still comes after
+        # every rule that preceded it for the element it was written for.
+        self.rules[body] = selectors
+
+    def style_class(self, css: str) -> str:
+        """Returns the atomic class applying a declaration block, defining it in the sheet on first use."""
+        known = _class_names.get(css)
+        if known is None:
+            body = _normalize(css)
+            known = (_class_name(body), body)
+            _class_names.put(css, known)
+        name, body = known
+
+        defined = self.classes.get(name)
+        if defined is not None and defined != body:
+            # Another style has the same short name: this one is named after its full hash
+            name = _class_name(body, digest_size=16)
+            defined = self.classes.get(name)
+        if defined is None:
+            self.classes[name] = body
+            self.add_rule(f".{name}", body)
+        return name
+
+    def render_unwritten(self) -> str:
+        """Returns the rules added since this was last called, in the order they were added."""
+        css = "\n".join(f"{selector} {{ {body} }}" for selector, body in self.unwritten or [])
+        if self.unwritten is not None:
+            self.unwritten = []
+        return css
+
+    def render(self) -> str:
+        return "\n".join(f"{', '.join(selectors)} {{ {body} }}" for body, selectors in self.rules.items())
+
+
+_class_names = LRUCache(4096)
+'''The (atomic class name, normalized declarations) of each resolved style, shared across runs and sessions.'''
+
+
+def _class_name(body: str, digest_size: int = 6) -> str:
+    return "stx-" + hashlib.blake2b(body.encode(), digest_size=digest_size).hexdigest()
+
+
+def _normalize(declarations: str) -> str:
+    """Removes comments and collapses whitespace, so equivalent declaration blocks compare equal."""
+    declarations = re.sub(r"/\*.*?\*/", "", str(declarations), flags=re.DOTALL)
+    return " ".join(declarations.split())
+
+
+_active_sheet: ContextVar[Optional[StyleSheet]] = ContextVar("stylesheet", default=None)
+
+
+def emit_css(rules: List[CSSRule]):
+    """
+    Adds CSS rules to the book's stylesheet, or writes them right away if no stylesheet is being collected.
+    """
+    record("css", rules)
+    sheet = _active_sheet.get()
+    if sheet is None:
+        css = "\n".join(f"{selector} {{ {declarations} }}" for selector, declarations in rules)
+        backend().html(f"<style>{css}</style>")
+        return
+
+    # Rules targeting the same selector are folded first, so that merging them with other
+    # elements' rules can't change the order in which they apply to their own element.
+    folded: Dict[str, str] = {}
+    for selector, declarations in rules:
+        folded[selector] = f"{folded[selector]} {declarations}" if selector in folded else str(declarations)
+
+    for selector, declarations in folded.items():
+        sheet.add_rule(selector, declarations)
+
+
+def style_attr(style) -> str:
+    """
+    Returns the attribute applying a style to an HTML tag.
+
+    When atomic classes are enabled and a stylesheet is being collected, each distinct resolved style
+    is defined once in the stylesheet and referenced through a short class name. Otherwise, the style
+    is inlined in a `style` attribute.
+    """
+    sheet = _active_sheet.get()
+    if sheet is None or not get_book_config().atomic_classes:
+        return f' style="{style}"'
+
+    css = str(style)
+    if not css.strip():
+        return ""
+    return f' class="{define_style_class(css)}"'
+
+
+def define_style_class(css: str) -> Optional[str]:
+    """Returns the atomic class applying a declaration block, defined in the active stylesheet."""
+    record("class", css)
+    sheet = _active_sheet.get()
+    return sheet.style_class(css) if sheet is not None else None
+
+
+@contextmanager
+def block_stylesheet():
+    """
+    A Context Manager collecting the CSS rules emitted inside it into a <style> element written where it starts.
+
+    Used for blocks run as fragments, which rerun on their own: their rules can't go to the book's stylesheet.
+    """
+    if not get_book_config().shared_stylesheet:
+        yield None
+        return
+
+    slot = st.empty()
+    sheet = StyleSheet()
+    token = _active_sheet.set(sheet)
+    try:
+        yield sheet
+    finally:
+        _active_sheet.reset(token)
+        # The marker keeps Streamlit from moving a style-only element out of the fragment
+        slot.html(f'<style>{sheet.render()}</style><span class="stx-stylesheet"></span>')
+
+
+@contextmanager
+def book_stylesheet():
+    """
+    A Context Manager collecting the CSS rules emitted inside it into a single <style> element.
+
+    The sheet of the previous run is written first, so content isn't shown unstyled while the run
+    progresses. The new sheet is only written again if it differs from it. On the first run of a session,
+    the rules are written block by block instead.
+    """
+    if not get_book_config().shared_stylesheet:
+        yield None
+        return
+
+    document = active_document()
+    if document is not None:
+        # A rendered document is written once: its sheet just goes in its <head>
+        sheet = StyleSheet()
+        token = _active_sheet.set(sheet)
+        try:
+            yield sheet
+        finally:
+            _active_sheet.reset(token)
+            document.head.append(f"<style>{sheet.render()}</style>")
+        return
+
+    previous = st.session_state.get(streamtex_stylesheet)
+    sheet = StyleSheet()
+    if previous:
+        st.html(f"<style>{previous}</style>")
+    else:
+        # The first run of a session has no sheet to start with: the rules of each block are written
+        # once it is rendered (see `write_new_rules`), so the content isn't unstyled until the book ends
+        sheet.unwritten = []
+
+    token = _active_sheet.set(sheet)
+    try:
+        yield sheet
+    finally:
+        _active_sheet.reset(token)
+        css = sheet.render()
+        if sheet.unwritten is not None:
+            # The consolidated sheet is written first by the next run
+            unwritten = sheet.render_unwritten()
+            if unwritten:
+                st.html(f"<style>{unwritten}</style>")
+        elif css != previous:
+            st.html(f"<style>{css}</style>")
+        st.session_state[streamtex_stylesheet] = css
+
+
+def write_new_rules():
+    """Writes the rules added to the book's stylesheet since they were last written, if it is written block by block."""
+    sheet = _active_sheet.get()
+    if sheet is not None and sheet.unwritten:
+        st.html(f"<style>{sheet.render_unwritten()}</style>")
@@ -0,0 +1,45 @@
+import streamlit as st
+from typing import Dict
+
+from . import styles
+from .backend import backend, active_document
+
+streamtex_theme = "_streamtex_theme"
+
+
+def selected_theme(themes: Dict[str, dict]) -> str:
+    """Returns the name of the switchable theme selected by the reader (the first one by default)."""
+    names = list(themes)
+    name = st.session_state.get(streamtex_theme) if active_document() is None else None
+    return name if name in names else names[0]
+
+
+def theme_stylesheet(theme: dict) -> str:
+    """Returns the <style> element defining the variables of a switchable theme."""
+    return f"<style>{styles.theme_css(theme)}</style>"
+
+
+@st.fragment
+def _theme_options(themes: Dict[str, dict]):
+    # The themes are passed along: fragment reruns happen outside of the run which set `styles.themes`
+    names = list(themes)
+    name = st.selectbox("**Theme**", options=names, index=names.index(selected_theme(themes)), key="streamtex_theme_list")
+    st.session_state[streamtex_theme] = name
+
+    # Switching theme only reruns this fragment: the marker keeps the sheet inside it, to be replaced
+    st.html(theme_stylesheet(themes[name]) + '<span class="stx-stylesheet"></span>')
+
+
+def add_theme_options():
+    """Adds a theme menu to the sidebar if the book has switchable themes (see `styles.themes`)."""
+    themes = styles.themes
+    if not themes:
+        return
+
+    if active_document() is not None:
+        # A rendered document has no widgets: it keeps the default theme
+        backend().html(theme_stylesheet(themes[selected_theme(themes)]))
+        return
+
+    with st.sidebar:
+        _theme_options(themes)
@@ -1,14 +1,17 @@
 import streamlit as st
+from contextlib import contextmanager
+from contextvars import ContextVar
 from dataclasses import dataclass
 from .styles import Style, StreamTeX_Styles as s
 from .enums import Tag
 from typing import Optional
+from .cache import record
 
 streamtex_toc_items = "_streamtex_toc_items"
 streamtex_toc_lvl = "_streamtex_toc_lvl"
 
-toc: Optional[TOCRegistry] = None
-'''The global ToC Registry.'''
+_toc: ContextVar[Optional['TOCRegistry']] = ContextVar("toc_registry", default=None)
+'''The ToC Registry of the current run.'''
 
 @dataclass
 class TOCConfig:
@@ -37,6 +40,8 @@ class TOCRegistry:
         '''The starting level of the ToC. It is used to keep track of the ToC during generation.'''
         self.numbers = []
         '''List to keep track of title numbers.'''
+        self.calls = []
+        '''The (label, level) arguments each entry was registered with.'''
         
     def get_entries(self):
         '''A list of ToC levels registered.'''
@@ -47,6 +52,7 @@ class TOCRegistry:
         self.toc_list = []
         self.current_level = 1
         self.numbers = []
+        self.calls = []
     
     def register_entry(self, label: str, level: str):
         """
@@ -54,6 +60,8 @@ class TOCRegistry:
         
         `level` can be '+x' or '-x' for relative TOC levels, or just 'x' for absolute TOC levels.
         """
+        self.calls.append((label, level))
+
         # Determine the level
         if level.startswith("+") or level.startswith("-"):
             lvl = self.current_level + int(level)
@@ -95,16 +103,35 @@ class TOCRegistry:
     @staticmethod
     def get_key_anchor(title: str):
         return title.replace('.', '-').replace(' ', '-').lower()
+
+
+def deferred_toc_token(index: int, part: str) -> str:
+    '''Returns the placeholder standing for the anchor or the number ("anchor" or "number") of a deferred entry.'''
+    return f"\ue000stx-toc-{index}-{part}\ue001"
+
+
+class DeferredTOCRegistry(TOCRegistry):
+    '''
+    A registry for a block rendered apart from the blocks before it, whose numbering isn't known yet.
+
+    The anchors and numbers it returns are placeholders, which are resolved when the recorded output of
+    the block is replayed in the book, registering its entries in order (see `cache.replay`).
+    '''
+    def register_entry(self, label: str, level: str):
+        index = len(self.calls)
+        self.calls.append((label, level))
+        return deferred_toc_token(index, "anchor"), deferred_toc_token(index, "number")
     
 
     
 def reset_toc_registry(toc_config: TOCConfig = TOCConfig()):
     """Clears the registry for the current run."""
-    global toc
-    if toc is not None:
-        toc.reset()
-    elif toc_config is not None:
-        toc = TOCRegistry(toc_config)
+    _toc.set(TOCRegistry(toc_config) if toc_config is not None else None)
+
+def current_toc_config() -> Optional[TOCConfig]:
+    """Returns the configuration of the registry of the current run, or None if there is no ToC."""
+    toc = _toc.get()
+    return toc.config if toc is not None else None
         
 def register_toc_entry(label: str, level: str) -> str:
     """
@@ -112,18 +139,62 @@ def register_toc_entry(label: str, level: str) -> str:
     
     `level` can be '+x' or '-x' for relative TOC levels, or just 'x' for absolute TOC levels.
     """
-    global toc
+    toc = _toc.get()
     assert isinstance(toc, TOCRegistry), "TOC Registry is not initialized. Please call reset_toc_registry first."
     
+    record("toc", label, level)
     return toc.register_entry(label, level)
 
+def toc_state():
+    '''Returns the numbering state of the ToC, which decides the numbers of the next entries.'''
+    toc = _toc.get()
+    if toc is None:
+        return None
+    return (toc.config.numerate_titles, toc.current_level, tuple(toc.numbers))
+
+@contextmanager
+def resumed_toc(state, toc_config: Optional[TOCConfig]):
+    '''
+    A Context Manager registering entries into a scratch registry with the given configuration,
+    numbered from a state returned by `toc_state()`. It yields that registry, or None if there is no ToC.
+    '''
+    if toc_config is None or state is None:
+        yield None
+        return
+
+    toc = TOCRegistry(toc_config)
+    _, toc.current_level, numbers = state
+    toc.numbers = list(numbers)
+    token = _toc.set(toc)
+    try:
+        yield toc
+    finally:
+        _toc.reset(token)
+
+@contextmanager
+def deferred_toc(toc_config: TOCConfig = TOCConfig()):
+    '''A Context Manager registering entries into a `DeferredTOCRegistry`, or nowhere if `toc_config` is None.'''
+    toc = DeferredTOCRegistry(toc_config) if toc_config is not None else None
+    token = _toc.set(toc)
+    try:
+        yield toc
+    finally:
+        _toc.reset(token)
+
 def toc_entries():
     '''Returns the list of ToC entries registered.'''
-    global toc
+    toc = _toc.get()
     assert isinstance(toc, TOCRegistry), "TOC Registry is not initialized. Please call reset_toc_registry first."
     
     return toc.get_entries()
 
+def toc_calls():
+    '''Returns the (label, level) arguments of the ToC entries registered.'''
+    toc = _toc.get()
+    assert isinstance(toc, TOCRegistry), "TOC Registry is not initialized. Please call reset_toc_registry first."
+    
+    return toc.calls
+
 def get_key_anchor(title: str):
     '''Returns a key anchor version of the title text.'''
     return TOCRegistry.get_key_anchor(title)
\ No newline at end of file
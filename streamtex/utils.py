@@ -1,11 +1,13 @@
 import os
 import re
-import base64
-import requests
-from requests.exceptions import ConnectionError, Timeout
-from bs4 import BeautifulSoup as bs
-import uuid
+import mmap
+from typing import List, Optional, Tuple
+import binascii
+import hashlib
 import textwrap
+from contextlib import contextmanager
+from .backend import backend
+from contextvars import ContextVar
 
 def strip_html(html_string):
     """
@@ -25,57 +27,124 @@ def strip_html(html_string):
 
 def __get_page_preview(url: str):
     """
-    Fetches the page title and favicon URL for the given link.
-    If the connection is refused or times out, returns 'Could not fetch page' and None,
-    preventing display of any preview.
+    Returns the page title and favicon URL for the given link, and whether the page could be fetched.
+
+    The previews are stored on disk (see `previews.preview_store`), with the pages which couldn't be fetched:
+    each page is fetched at most once per TTL, by all sessions and processes.
+    """
+    from . import previews
+
+    preview = previews.preview_store.get(url)
+    if preview is None:
+        preview = previews.fetch_preview(url)
+        previews.preview_store.put(url, preview)
+    return preview
+
+class KeyScope:
+    """
+    Numbers the keys generated inside a block, so that the same calls produce the same keys on every rerun.
     """
-    title = url
-    favicon = 'https://www.google.com/s2/favicons?domain_url=' + url
+    def __init__(self, name: str = ""):
+        self.name = name
+        '''The path of the block, e.g. "/blocks.bck_title#0/blocks.sub_block#1".'''
+        self.count = 0
+        '''The number of keys generated so far in this scope.'''
+        self.occurrences = {}
+        '''How many times each nested block has been included so far in this scope.'''
+
+    def copy(self) -> "KeyScope":
+        scope = KeyScope(self.name)
+        scope.count = self.count
+        scope.occurrences = dict(self.occurrences)
+        return scope
+
+_key_scope: ContextVar[Optional[KeyScope]] = ContextVar("key_scope", default=None)
+
+def current_key_scope() -> KeyScope:
+    scope = _key_scope.get()
+    if scope is None:
+        scope = KeyScope()
+        _key_scope.set(scope)
+    return scope
+
+def reset_key_scope():
+    """Starts numbering keys from scratch. Called at the start of each run."""
+    _key_scope.set(KeyScope())
+
+@contextmanager
+def key_scope(name: str):
+    """
+    A Context Manager numbering the keys generated inside it independently of the rest of the page.
+    Including the same block twice yields two distinct scopes.
+    """
+    parent = current_key_scope()
+    occurrence = parent.occurrences.get(name, 0)
+    parent.occurrences[name] = occurrence + 1
+
+    token = _key_scope.set(KeyScope(f"{parent.name}/{name}#{occurrence}"))
     try:
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()
-        soup = bs(response.content, 'html.parser')
-
-        # Get the page title
-        title = soup.title.string.strip() if soup.title else 'No title found'
-
-        # Get the favicon
-        favicon = None
-        icon_link = soup.find('link', rel=lambda x: x and 'icon' in x.lower())
-        if icon_link and icon_link.get('href'):
-            favicon = icon_link['href']
-            if favicon.startswith('//'):
-                favicon = 'http:' + favicon
-            elif favicon.startswith('/'):
-                from urllib.parse import urljoin
-                favicon = urljoin(url, favicon)
-        else:
-            # Default favicon if not found
-            favicon = 'https://www.google.com/s2/favicons?domain_url=' + url
-
-        return title, favicon, True
-    
-    except (ConnectionError, Timeout):
-        # Specifically handle connection refusal or timeout
-        return title, favicon, False
+        yield
+    finally:
+        _key_scope.reset(token)
 
-    except Exception as e:
-        return 'Could not fetch page', None, False
+def fork_key_scope() -> KeyScope:
+    """Returns a copy of the current key scope, from which the blocks that follow can be included again with the same keys."""
+    return current_key_scope().copy()
+
+@contextmanager
+def resumed_key_scope(fork: KeyScope):
+    """A Context Manager generating keys as if it was at the point where `fork` was taken."""
+    token = _key_scope.set(fork.copy())
+    try:
+        yield
+    finally:
+        _key_scope.reset(token)
 
-def generate_key(prefix: str = "block"):
-    return f"{prefix}-{uuid.uuid4().hex}"
+def generate_key(prefix: str = "block", style = ""):
+    """
+    Returns a key that is unique in the page and stable across reruns.
+
+    It is derived from the enclosing block, the position of the call within that block and the style
+    of the element, so an unchanged rerun produces identical class names and CSS.
+    """
+    scope = current_key_scope()
+    index = scope.count
+    scope.count += 1
 
+    seed = f"{scope.name}|{prefix}|{index}|{style}"
+    return f"{prefix}-{hashlib.blake2b(seed.encode(), digest_size=8).hexdigest()}"
 
 
-def __get_base64_encoded_image(file_path: str):
-    """Converts an image to a base64 encoded string."""
+
+def __get_base64_encoded_image(file_path: str, prefix: str = ""):
+    """
+    Converts an image to a base64 encoded string, starting with `prefix` (e.g. "data:image/png;base64,").
+
+    The file is memory-mapped and encoded in chunks into a buffer of the final size,
+    so that it isn't held in memory as bytes, encoded bytes and string at once.
+    """
     try:
         with open(file_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+            size = os.fstat(image_file.fileno()).st_size
+            if size == 0:
+                return ""
+            with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                head = prefix.encode("ascii")
+                encoded = bytearray(len(head) + 4 * ((size + 2) // 3))
+                encoded[:len(head)] = head
+                position = len(head)
+                for start in range(0, size, _BASE64_CHUNK):
+                    chunk = binascii.b2a_base64(data[start:start + _BASE64_CHUNK], newline=False)
+                    encoded[position:position + len(chunk)] = chunk
+                    position += len(chunk)
+        return encoded.decode("ascii")
     except Exception as e:
         print(f"Error reading file {file_path}: {e}")
         return None
 
+_BASE64_CHUNK = 3 * 256 * 1024
+'''The number of bytes encoded at once: a multiple of 3, so that the chunks encode without padding.'''
+
 
 def __is_url(path: str):
     """Checks if the given path is a URL."""
@@ -89,20 +158,43 @@ def __is_relative_path(path: str):
     """Checks if the given path is a relative path."""
     return path.startswith((".", "..", "/", "\\"))
 
+mime_signatures: List[Tuple[int, bytes, str]] = [
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"GIF87a", "image/gif"),
+    (0, b"GIF89a", "image/gif"),
+    (8, b"WEBP", "image/webp"),
+    (4, b"ftypavif", "image/avif"),
+    (4, b"ftypavis", "image/avif"),
+    (0, b"BM", "image/bmp"),
+    (0, b"\x00\x00\x01\x00", "image/x-icon"),
+]
+'''The (offset, bytes, MIME type) identifying the formats of local images by their first bytes. More may be added.'''
+
+mime_extensions = {
+    "png": "image/png", "jpg": "image/jpeg", "jpeg": "image/jpeg", "gif": "image/gif",
+    "webp": "image/webp", "avif": "image/avif", "svg": "image/svg+xml", "bmp": "image/bmp", "ico": "image/x-icon",
+}
+'''The MIME types of images whose first bytes aren't recognized, by file extension.'''
+
 def __get_mime_type(file_path: str):
-    """Determine the MIME type based on the file extension."""
+    """Determine the MIME type of an image from its first bytes, or else from its file extension."""
+    try:
+        with open(file_path, "rb") as image_file:
+            head = image_file.read(512)
+    except OSError:
+        head = b""
+
+    for offset, signature, mime_type in mime_signatures:
+        if head[offset:offset + len(signature)] == signature:
+            return mime_type
+    # SVG is text: an <svg> element, possibly after an XML declaration, a doctype or comments
+    if re.match(rb"(\xef\xbb\xbf)?\s*(<\?xml[^>]*>\s*|<!--.*?-->\s*|<!DOCTYPE[^>]*>\s*)*<svg[\s>]", head, re.DOTALL | re.IGNORECASE):
+        return "image/svg+xml"
+
     extension = file_path.lower().split('.')[-1]
-    if extension == "png":
-        return "image/png"
-    elif extension in ["jpg", "jpeg"]:
-        return "image/jpeg"
-    elif extension == "gif":
-        return "image/gif"
-    else:
-        return None  # Unsupported format or no extension
-    
-    
-import streamlit as st
+    return mime_extensions.get(extension)  # None: unsupported format or no extension
+
 
 def inject_link_preview_scaffold():
     """
@@ -195,8 +287,10 @@ def inject_link_preview_scaffold():
 
                     try {
                         var urlObj = new URL(href);
-                        cardImg.src = 'https://www.google.com/s2/favicons?domain_url=' + href + '&sz=64';
-                        cardTitle.textContent = urlObj.hostname;
+                        // The title and icon of the page, once StreamTeX has fetched them
+                        var preview = (window.stxPreviews || {})[link.getAttribute('href')];
+                        cardImg.src = (preview && preview.favicon) || 'https://www.google.com/s2/favicons?domain_url=' + href + '&sz=64';
+                        cardTitle.textContent = preview ? preview.title : urlObj.hostname;
                         cardUrl.textContent = href;
 
                         var rect = link.getBoundingClientRect();
@@ -230,8 +324,8 @@ def inject_link_preview_scaffold():
     </script>
     """)
     
-    st.html(css)
-    st.html(js, unsafe_allow_javascript=True)
+    backend().html(css)
+    backend().html(js, unsafe_allow_javascript=True)
     
     
 def contain_link(html_content="", link="", no_link_decor=False, hover=True):
@@ -257,6 +351,10 @@ def contain_link(html_content="", link="", no_link_decor=False, hover=True):
     css_classes = ""
     if hover and not is_internal:
         css_classes = ' class="streamtex-link"'
+        if __is_url(clean_link):
+            # The page's title and icon are fetched in the background, for the hover card
+            from .previews import note_link
+            note_link(clean_link)
         
     style_attr = ""
     if no_link_decor:
@@ -1,10 +1,11 @@
 from typing import Optional
-import streamlit as st
 from streamlit.components.v2 import component
 from .styles import Style, StreamTeX_Styles
 from .enums import Tag, Tags
 from .utils import contain_link, generate_key, strip_html
 from .toc import register_toc_entry
+from .buffer import emit_html
+from .stylesheet import style_attr
 
 
 def st_write(
@@ -42,7 +43,7 @@ def st_write(
     elementId = f" id='{key_anchor}'" if key_anchor else ""
     
     # Wrap the text in the specified tag with the given style. This ensures consistent styling.   
-    txt_tag = f'<{tag}{elementId} style="{container_style}">{final_txt}</{tag}>'
+    txt_tag = f'<{tag}{elementId}{style_attr(container_style)}>{final_txt}</{tag}>'
     
     # Handle optional hyperlinking and hover effects.
     # Note: If inline links are used in args, avoid using a wrapper link here 
@@ -50,7 +51,7 @@ def st_write(
     # Thus, this could be a future source of bugs.
     txt_tag = contain_link(txt_tag, link, no_link_decor, hover)
 
-    st.html(txt_tag)
+    emit_html(txt_tag)
 
 def _parse_args(*args, style: Style = StreamTeX_Styles.none, no_link_decor:bool=False, hover:bool=False):
     """
@@ -84,7 +85,7 @@ def _parse_args(*args, style: Style = StreamTeX_Styles.none, no_link_decor:bool=
             elif len(item) == 3:
                 sub_style, sub_txt, sub_link = item
             
-            span = f'<span style="{sub_style}">{sub_txt}</span>'
+            span = f'<span{style_attr(sub_style)}>{sub_txt}</span>'
             span = contain_link(span, sub_link, no_link_decor=no_link_decor, hover=hover)
 
             html_parts.append(span)
@@ -20,7 +20,7 @@ List of st_* functions implemented in the StreamTeX library:
 - st_block()    # style
 - st_span()     # style
 - st_list()     # list_type, l_style, li_style
-- st_grid()     # cols, grid_style, cell_styles
+- st_grid()     # cols, grid_style, cell_styles, cycle
 - st_overlay()  # style
 
 
@@ -166,7 +166,7 @@ def build():
 
     # st_grid cell_styles can be a stylegrid (whose operations are as follows: multiplication replaces, addition adds)
     with st_grid(
-        cols=3,
+        cols=2,
         cell_styles = sg.create("A1:B3", s.large) * sg.create("A1:B1, B3", s.text.colors.white + s.container.bg_colors.red_bg)
         ) as g:
         with g.cell(): st_write("A1")
@@ -175,6 +175,15 @@ def build():
         with g.cell(): st_write("B2")
         with g.cell(): st_write("A3")
         with g.cell(): st_write("B3")
+
+    # st_grid cell_styles can repeat for any number of cells: a one-column matrix stripes every other row
+    with st_grid(
+        cols=2,
+        cell_styles=[[s.none], [s.container.bg_colors.light_grey_bg]],
+        cycle=True) as g:
+        for i in range(1, 5):
+            with g.cell(): st_write(f"Row {i}, Col 1")
+            with g.cell(): st_write(f"Row {i}, Col 2")
     
     with st_block(style=s.center_txt + s.big):
         st_write("This is inside a div.")
@@ -0,0 +1,17 @@
+import pytest
+from streamlit.runtime.forward_msg_queue import ForwardMsgQueue
+
+
+@pytest.fixture
+def sent_deltas(monkeypatch):
+    """The (delta path, delta) of every element sent to the browser, in order."""
+    deltas = []
+    enqueue = ForwardMsgQueue.enqueue
+
+    def recording_enqueue(self, msg):
+        if msg.HasField("delta"):
+            deltas.append((tuple(msg.metadata.delta_path), msg.delta))
+        enqueue(self, msg)
+
+    monkeypatch.setattr(ForwardMsgQueue, "enqueue", recording_enqueue)
+    return deltas
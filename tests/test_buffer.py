@@ -0,0 +1,50 @@
+from streamlit.testing.v1 import AppTest
+
+block_source = '''
+import streamlit as st
+from streamtex import st_write, st_block, st_space
+from streamtex.styles import Style
+
+def build():
+    st_write(Style("color: red;", "red"), "First")
+    st_write(Style("", "plain"), "grouped with the first")
+    st.markdown("A native element")
+    st_write(Style("", "plain"), "After it")
+    with st_block(Style("padding: 1em;", "padded")):
+        st_write(Style("", "plain"), "In a block")
+        st_space("v", 2)
+    st_write(Style("", "plain"), "Alone")
+'''
+
+app_source = '''
+import sys
+sys.path.insert(0, {folder!r})
+from streamtex import st_book, BookConfig
+import buffered_block
+st_book([buffered_block], book_config=BookConfig(link_previews=False))
+'''
+
+
+def test_groups_are_sent_once_and_reruns_send_the_same_deltas(tmp_path, sent_deltas):
+    (tmp_path / "buffered_block.py").write_text(block_source)
+    app = tmp_path / "app.py"
+    app.write_text(app_source.format(folder=str(tmp_path)))
+
+    at = AppTest.from_file(str(app))
+    runs = []
+    for _ in range(3):
+        sent_deltas.clear()
+        at.run()
+        assert not at.exception
+        runs.append(list(sent_deltas))
+
+    # No element is replaced during a run: the browser never shows a group cut to its first fragment
+    for deltas in runs:
+        paths = [path for path, _ in deltas]
+        assert len(paths) == len(set(paths))
+    # The first run has no previous stylesheet to start with: the reruns after it send the same deltas
+    assert runs[2] == runs[1]
+
+    bodies = [html.proto.body for html in at.main.get("html")]
+    group = next(body for body in bodies if "First" in body)
+    assert "grouped with the first" in group and "A native element" not in group
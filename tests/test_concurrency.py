@@ -0,0 +1,93 @@
+import importlib.util
+import re
+import threading
+
+import streamtex.styles as sts
+from streamtex import st_book, BookConfig, TOCConfig
+from streamtex.backend import HtmlDocument, set_active_document
+
+block_source = '''
+from streamtex import st_write
+from streamtex.enums import Tags
+from streamtex.styles import Style
+
+accent = Style("color: red;", "accent")
+
+def build():
+    st_write(Style("", "title"), "{name} title", tag=Tags.h1, toc_lvl="1")
+    st_write(Style("", "section"), "{name} section", tag=Tags.h2, toc_lvl="+1")
+    st_write(accent, "{name} text")
+'''
+
+themes = [{}, {"accent": "color: green;"}, {"accent": "color: blue;"}]
+
+
+def load_blocks(folder, names):
+    blocks = {}
+    for name in names:
+        path = folder / f"block_{name}.py"
+        path.write_text(block_source.format(name=name))
+        spec = importlib.util.spec_from_file_location(f"stress_blocks.block_{name}", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        blocks[name] = module
+    return blocks
+
+
+def render(module_list, theme, numerate):
+    """Renders a book as a session would: its theme set by its script, in the context of its thread."""
+    sts.theme = theme
+    document = HtmlDocument()
+    set_active_document(document)
+    try:
+        st_book(module_list, TOCConfig(numerate_titles=numerate), book_config=BookConfig(render_cache=False))
+    finally:
+        set_active_document(None)
+    return document.render()
+
+
+def toc_titles(html):
+    sidebar = html[html.index('class="stSidebar'):]
+    return [re.sub(r"<[^>]+>|&nbsp;", "", link) for link in re.findall(r"<a href=\"#[^\"]*\">.*?</a>", sidebar)]
+
+
+def test_sessions_rendered_concurrently_stay_isolated(tmp_path, capsys):
+    blocks = load_blocks(tmp_path, "abc")
+    # Each session has its own blocks, numbering and theme
+    sessions = [
+        ([blocks["a"], blocks["b"]], themes[0], True),
+        ([blocks["c"], blocks["a"], blocks["b"]], themes[1], True),
+        ([blocks["b"]], themes[2], False),
+        ([blocks["c"], blocks["b"]], themes[1], False),
+    ]
+    expected = [render(*session) for session in sessions]
+    assert len(set(expected)) == len(sessions)
+    assert toc_titles(expected[1])[:4] == ["1 c title", "1.1 c section", "2 a title", "2.1 a section"]
+    assert toc_titles(expected[2])[:2] == ["b title", "b section"]
+    assert "color: blue;" in expected[2] and "color: green;" not in expected[2]
+
+    results, errors = [], []
+    threads_count, runs = 16, 4
+    barrier = threading.Barrier(threads_count)
+
+    def session_thread(n):
+        barrier.wait()
+        for run in range(runs):
+            i = (n + run) % len(sessions)
+            try:
+                results.append((i, render(*sessions[i])))
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=session_thread, args=(n,)) for n in range(threads_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    capsys.readouterr()
+
+    assert errors == []
+    assert len(results) == threads_count * runs
+    for i, html in results:
+        assert toc_titles(html) == toc_titles(expected[i])
+        assert html == expected[i]
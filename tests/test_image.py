@@ -0,0 +1,58 @@
+import os
+import re
+import time
+from urllib.parse import unquote
+
+from PIL import Image
+
+from streamtex import assets, image
+from streamtex.cache import Recorder, _active_recorder
+
+
+def wait_for_conversions(timeout=30):
+    deadline = time.monotonic() + timeout
+    while assets._converting and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not assets._converting
+
+
+def test_variants_are_generated_in_the_background(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "static" / "images").mkdir(parents=True)
+    Image.effect_noise((1600, 900), 64).convert("RGB").save(tmp_path / "static" / "images" / "photo.jpg", quality=90)
+    img_src = image.get_image_src("photo.jpg")
+
+    # 1. The first render offers the image as it is, and isn't cached
+    recorder = Recorder()
+    token = _active_recorder.set(recorder)
+    try:
+        assert image._image_sources("photo.jpg", img_src, "50%") == ("", "")
+    finally:
+        _active_recorder.reset(token)
+    assert not recorder.valid
+
+    # 2. Once the copies are generated, they are offered
+    wait_for_conversions()
+    srcset, sources = image._image_sources("photo.jpg", img_src, "50%")
+    assert "320w" in srcset and "1600w" in srcset
+    assert sources == ""
+
+
+def test_srcset_urls_of_published_images_are_encoded_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "imgs").mkdir()
+    Image.effect_noise((1600, 900), 64).convert("RGB").save(tmp_path / "imgs" / "my photo é.jpg", quality=90)
+    uri = "./imgs/my photo é.jpg"
+    img_src = image.get_image_src(uri)
+    assert img_src.startswith("app/static/stx-assets/my%20photo%20%C3%A9-")
+
+    image._image_sources(uri, img_src, "100%")
+    wait_for_conversions()
+    srcset, _ = image._image_sources(uri, img_src, "100%")
+
+    urls = [candidate.split()[0] for candidate in re.search(r'srcset="([^"]*)"', srcset).group(1).split(", ")]
+    assert img_src in urls and len(urls) > 1
+    published = set(os.listdir(tmp_path / "static" / "stx-assets"))
+    for url in urls:
+        assert url.startswith("app/static/stx-assets/")
+        assert unquote(url[len("app/static/stx-assets/"):]) in published
@@ -0,0 +1,25 @@
+import re
+import subprocess
+import sys
+
+max_import_ms = 100
+'''The longest StreamTeX's own modules may take to import (streamlit not included), in milliseconds.'''
+
+heavy_modules = ("PIL", "requests", "bs4", "sqlite3")
+'''Modules only needed for images and link previews: importing StreamTeX must not load them.'''
+
+
+def test_import_is_light():
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c",
+         "import sys, streamtex; print(' '.join(m for m in %r if m in sys.modules))" % (heavy_modules,)],
+        capture_output=True, text=True, check=True,
+    )
+    assert result.stdout.split() == []
+
+    # "import time: <self us> | <cumulative us> | <module>"
+    self_us = sum(
+        int(match.group(1))
+        for match in re.finditer(r"import time:\s+(\d+) \|\s+\d+ \|\s+(streamtex\b\S*)$", result.stderr, re.MULTILINE)
+    )
+    assert 0 < self_us < max_import_ms * 1000, f"StreamTeX's modules took {self_us / 1000:.1f} ms to import"
@@ -0,0 +1,165 @@
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from streamtex import previews
+from streamtex.previews import PreviewPrefetcher, PreviewStore
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    """
+    Serves pages whose <head> is followed by `?size=` bytes of body, after `?delay=` seconds,
+    counting connections, requests and bytes sent. The pages under /missing are not found.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        with self.server.lock:
+            self.server.requests.append(self.path)
+        time.sleep(float(query.get("delay", ["0"])[0]))
+        if parts.path.startswith("/missing"):
+            self.send_error(404)
+            return
+
+        path = parts.path
+        head = f'<html><head><title>Page {path} é</title><link rel="icon" href="/icons{path}.ico"></head><body>'
+        body = head.encode() + b"x" * int(query.get("size", ["0"])[0]) + b"</body></html>"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            for start in range(0, len(body), 65536):
+                self.wfile.write(body[start:start + 65536])
+                with self.server.lock:
+                    self.server.sent += len(body[start:start + 65536])
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PageHandler)
+    server.lock = threading.Lock()
+    server.connections = 0
+    server.sent = 0
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = PreviewStore(str(tmp_path / "previews.sqlite3"))
+    monkeypatch.setattr(previews, "preview_store", store)
+    return store
+
+
+def prefetch_all(urls, timeout=30, deadline=30):
+    prefetcher = PreviewPrefetcher(deadline=deadline)
+    prefetcher.prefetch(urls)
+    deadline = time.monotonic() + timeout
+    while prefetcher._pending and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert not prefetcher._pending
+
+
+def test_pages_of_a_host_share_one_connection(server, store):
+    urls = [f"http://127.0.0.1:{server.server_port}/page{i}?size=100000" for i in range(5)]
+    prefetch_all(urls)
+
+    assert server.connections == 1
+    for i, url in enumerate(urls):
+        title, favicon, fetched = store.get(url)
+        assert fetched and title == f"Page /page{i} é"
+        assert favicon == f"http://127.0.0.1:{server.server_port}/icons/page{i}.ico"
+
+
+def test_large_pages_are_not_downloaded(server, store):
+    url = f"http://127.0.0.1:{server.server_port}/huge?size=20000000"
+    prefetch_all([url])
+
+    assert store.get(url)[0] == "Page /huge é"
+    # The connection is closed after the <head>: the server only gets to send what the socket buffers hold
+    assert server.sent < 10_000_000
+
+
+def test_stored_previews_are_read_in_one_query(server, store):
+    urls = [f"http://127.0.0.1:{server.server_port}/page{i}" for i in range(3)]
+    prefetch_all(urls[:2])
+
+    found = store.get_many(urls + ["http://127.0.0.1:1/unknown"])
+    assert set(found) == set(urls[:2])
+    assert found[urls[0]] == store.get(urls[0])
+
+
+def test_links_the_deadline_runs_out_for_are_left_for_a_later_batch(server, store):
+    urls = [f"http://127.0.0.1:{server.server_port}/slow{i}?delay=1.5" for i in range(2)]
+    prefetch_all(urls, deadline=2)
+
+    # The second page of the host was cut off by the deadline, not found to fail
+    assert store.get(urls[0])[2]
+    assert store.get(urls[1]) is None
+
+    prefetch_all(urls)
+    assert store.get(urls[1]) == ("Page /slow1 é", f"http://127.0.0.1:{server.server_port}/icons/slow1.ico", True)
+    assert server.requests.count("/slow0?delay=1.5") == 1
+
+
+def test_spellings_of_a_link_share_one_preview(server, store):
+    port = server.server_port
+    prefetch_all([f"http://127.0.0.1:{port}/page#intro"])
+    prefetch_all([f"HTTP://127.0.0.1:{port}/page", f"http://127.0.0.1:{port}/page#usage"])
+
+    assert server.requests == ["/page"]
+    assert store.get(f"http://127.0.0.1:{port}/page#other")[0] == "Page /page é"
+
+
+def test_pages_not_found_are_fetched_once_per_failure_ttl(server, store):
+    url = f"http://127.0.0.1:{server.server_port}/missing"
+    prefetch_all([url])
+    prefetch_all([url])
+
+    assert server.requests == ["/missing"]
+    assert store.get(url) == ("Could not fetch page", None, False)
+
+
+def test_previews_are_fetched_again_once_expired(server, tmp_path, monkeypatch):
+    store = PreviewStore(str(tmp_path / "previews.sqlite3"), ttl=0.5)
+    monkeypatch.setattr(previews, "preview_store", store)
+    url = f"http://127.0.0.1:{server.server_port}/page"
+    prefetch_all([url])
+    prefetch_all([url])
+    assert server.requests == ["/page"]
+
+    time.sleep(0.6)
+    assert store.get(url) is None
+    prefetch_all([url])
+    assert server.requests == ["/page", "/page"]
+
+
+def test_previews_are_shared_by_processes(server, store):
+    url = f"http://127.0.0.1:{server.server_port}/page"
+    prefetch_all([url])
+
+    code = f"from streamtex.previews import PreviewStore; print(PreviewStore({store.path!r}).get({url!r}))"
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert output.strip() == repr(store.get(url))
+    assert server.requests == ["/page"]
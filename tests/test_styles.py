@@ -0,0 +1,101 @@
+import random
+import tracemalloc
+
+from streamtex.styles import Style, StyleGrid, StreamTeX_Styles
+
+
+# The dense grids of the original implementation, which StyleGrid must match cell for cell
+
+def dense_create(cells, style, num_rows=None, num_cols=None):
+    ranges = StyleGrid._parse_ranges(cells)
+    rows = max(num_rows or 0, max(last_row for _, _, last_row, _ in ranges) + 1)
+    cols = max(num_cols or 0, max(last_col for _, _, _, last_col in ranges) + 1)
+    grid = [[StreamTeX_Styles.none] * cols for _ in range(rows)]
+    for first_row, first_col, last_row, last_col in ranges:
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                grid[row][col] = style
+    return grid
+
+
+def dense_combine(grid, other, combine_styles):
+    rows = max(len(grid), len(other))
+    cols = max([len(row) for row in grid + other] or [0])
+    combined = [[StreamTeX_Styles.none] * cols for _ in range(rows)]
+    for i, row in enumerate(grid):
+        for j, style in enumerate(row):
+            combined[i][j] = style
+    for i, row in enumerate(other):
+        for j, style in enumerate(row):
+            combined[i][j] = combine_styles(combined[i][j], style)
+    return combined
+
+
+operations = {
+    "+": (lambda a, b: a + b, lambda s1, s2: s1 + s2),
+    "-": (lambda a, b: a - b, lambda s1, s2: s1 - s2),
+    "*": (lambda a, b: a * b, lambda s1, s2: s2 if s2 else s1),
+}
+
+styles = [Style("color: red;", "red"), Style("font-size: 3pt;", "small"),
+          Style("color: blue; margin: 0;", "blue"), Style("font-weight: bold;", "bold")]
+
+
+def random_cells(rng):
+    cells = []
+    for _ in range(rng.randint(1, 3)):
+        first = f"{'ABCDEF'[rng.randint(0, 5)]}{rng.randint(1, 8)}"
+        last = f"{'ABCDEF'[rng.randint(0, 5)]}{rng.randint(1, 8)}"
+        cells.append(first if rng.random() < 0.3 else f"{first}:{last}")
+    return ",".join(cells)
+
+
+def css_of(grid):
+    return [[str(style) for style in row] for row in grid]
+
+
+def test_style_at_matches_the_dense_grid():
+    for seed in range(200):
+        rng = random.Random(seed)
+        grid = dense = None
+        for _ in range(rng.randint(1, 4)):
+            if rng.random() < 0.2:
+                matrix = [[rng.choice(styles) for _ in range(rng.randint(0, 4))] for _ in range(rng.randint(0, 4))]
+                operand, operand_dense = StyleGrid(matrix), matrix
+            else:
+                cells, style = random_cells(rng), rng.choice(styles)
+                num_rows, num_cols = rng.choice([None, rng.randint(1, 10)]), rng.choice([None, rng.randint(1, 7)])
+                operand = StyleGrid.create(cells, style, num_rows, num_cols)
+                operand_dense = dense_create(cells, style, num_rows, num_cols)
+            if grid is None:
+                grid, dense = operand, operand_dense
+            else:
+                combine_grids, combine_styles = operations[rng.choice("+-*")]
+                grid, dense = combine_grids(grid, operand), dense_combine(dense, operand_dense, combine_styles)
+
+        for row in range(len(dense) + 1):
+            for col in range(max([len(r) for r in dense] or [0]) + 1):
+                style = grid.style_at(row, col)
+                expected = dense[row][col] if row < len(dense) and col < len(dense[row]) else None
+                assert (str(style) if style is not None else None) == (str(expected) if expected is not None else None)
+        assert css_of(grid.css_grid) == css_of(dense)
+
+
+def test_large_sparse_grid_stays_small():
+    def build():
+        return (StyleGrid.create("A1:Z5000", StreamTeX_Styles.bold)
+                + StyleGrid.create("A1:Z1", StreamTeX_Styles.huge)
+                * StyleGrid.create("B2:B5000,D2:D5000", StreamTeX_Styles.italic))
+
+    tracemalloc.start()
+    grid = build()
+    sparse, _ = tracemalloc.get_traced_memory()
+    assert str(grid.style_at(4999, 1)) == str(StreamTeX_Styles.bold + StreamTeX_Styles.italic)
+    assert grid.style_at(5000, 0) is None
+    grid.css_grid
+    dense, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # 130 000 cells: the ranges take a few KiB, the matrix over a MiB
+    assert sparse < 64 * 1024
+    assert dense > 20 * sparse
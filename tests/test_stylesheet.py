@@ -0,0 +1,86 @@
+import hashlib
+
+from streamtex import stylesheet
+from streamtex.stylesheet import StyleSheet
+
+
+def test_style_class_is_defined_once():
+    sheet = StyleSheet()
+    name = sheet.style_class("color: red;")
+    assert sheet.style_class("color:  red; /* again */") == name
+    assert sheet.render() == f".{name} {{ color: red; }}"
+
+
+def test_colliding_class_names_keep_their_own_style(monkeypatch):
+    # Every style gets the same short name
+    def class_name(body, digest_size=6):
+        if digest_size == 6:
+            return "stx-same"
+        return "stx-" + hashlib.blake2b(body.encode(), digest_size=digest_size).hexdigest()
+    monkeypatch.setattr(stylesheet, "_class_name", class_name)
+    monkeypatch.setattr(stylesheet, "_class_names", stylesheet.LRUCache(16))
+
+    sheet = StyleSheet()
+    red = sheet.style_class("color: red;")
+    blue = sheet.style_class("color: blue;")
+    assert red == "stx-same"
+    assert blue != red
+    assert sheet.classes == {red: "color: red;", blue: "color: blue;"}
+    assert f".{blue} {{ color: blue; }}" in sheet.render()
+    assert sheet.style_class("color: blue;") == blue
+
+
+def test_class_names_are_bounded():
+    for i in range(stylesheet._class_names.max_entries + 10):
+        StyleSheet().style_class(f"width: {i}px;")
+    assert len(stylesheet._class_names) <= stylesheet._class_names.max_entries
+
+
+block_source = '''
+from streamtex import st_write, st_block
+from streamtex.styles import Style
+
+def build():
+    with st_block(Style("padding: {padding};", "padded")):
+        st_write(Style("", "plain"), "{name}")
+'''
+
+app_source = '''
+import sys
+sys.path.insert(0, {folder!r})
+from streamtex import st_book, BookConfig
+import sheet_block_a, sheet_block_b
+st_book([sheet_block_a, sheet_block_b], book_config=BookConfig(link_previews=False))
+'''
+
+
+def test_first_run_writes_the_rules_of_each_block_after_it(tmp_path, sent_deltas):
+    from streamlit.testing.v1 import AppTest
+
+    (tmp_path / "sheet_block_a.py").write_text(block_source.format(padding="1em", name="Block A"))
+    (tmp_path / "sheet_block_b.py").write_text(block_source.format(padding="2em", name="Block B"))
+    app = tmp_path / "app.py"
+    app.write_text(app_source.format(folder=str(tmp_path)))
+
+    def run():
+        sent_deltas.clear()
+        at.run()
+        assert not at.exception
+        bodies = [delta.new_element.html.body for _, delta in sent_deltas if delta.new_element.HasField("html")]
+        sheets = [i for i, body in enumerate(bodies) if "st-key-block" in body and body.startswith("<style>")]
+        block_b = next(i for i, body in enumerate(bodies) if "Block B" in body)
+        return bodies, sheets, block_b
+
+    at = AppTest.from_file(str(app))
+
+    # 1. Each block's rules are written as soon as it is rendered
+    bodies, sheets, block_b = run()
+    assert len(sheets) == 2
+    assert "padding: 1em;" in bodies[sheets[0]] and "padding: 2em;" not in bodies[sheets[0]]
+    assert sheets[0] < block_b < sheets[1]
+
+    # 2. Reruns start with the whole sheet of the previous run, and don't write it again
+    bodies, sheets, block_b = run()
+    assert len(sheets) == 1
+    assert "padding: 1em;" in bodies[sheets[0]] and "padding: 2em;" in bodies[sheets[0]]
+    assert sheets[0] < block_b